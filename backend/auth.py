@@ -1,36 +1,48 @@
-import os
-from dotenv import load_dotenv
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+import hashlib
+import secrets
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 from schemas import TokenData
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from database import get_db
-from models import User
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload, object_session
+from config import get_settings
+from database import get_read_db, SessionLocal
+from models import User, RefreshToken
+import passwords
+import tokens
+import tracing
 
-# Load environment variables
-load_dotenv()
-
-# Security settings from environment variables
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return passwords.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return passwords.hash_password(password)
+
+def password_needs_rehash(user: User) -> bool:
+    return passwords.needs_update(user.hashed_password)
+
+def rehash_password(user_id: int, old_hash: str, password: str):
+    """Store a hash at the current scheme and cost; run after the login response"""
+    new_hash = get_password_hash(password)
+    db = SessionLocal()
+    try:
+        # Only replace the hash that was verified, never a password changed meanwhile
+        db.query(User).filter(User.id == user_id, User.hashed_password == old_hash).update(
+            {User.hashed_password: new_hash}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
 
 def get_user(db: Session, username: str):
     return db.query(User).filter(User.username == username).first()
 
+@tracing.traced("auth.authenticate_user")
 def authenticate_user(db: Session, username: str, password: str):
     user = get_user(db, username)
     if not user:
@@ -39,6 +51,13 @@ def authenticate_user(db: Session, username: str, password: str):
         return False
     return user
 
+def token_claims_for(user: User) -> dict:
+    """Build the claims for an access token issued to this user"""
+    claims = {"sub": user.username}
+    if get_settings().embed_user_claims:
+        claims.update({"uid": user.id, "active": user.is_active})
+    return claims
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -46,23 +65,91 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return tokens.encode(to_encode)
+
+def _hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def create_refresh_token(db: Session, user: User) -> str:
+    """Issue a new opaque refresh token; only its digest is persisted"""
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        user_id=user.id,
+        token_hash=_hash_refresh_token(token),
+        expires_at=datetime.utcnow() + timedelta(days=get_settings().refresh_token_expire_days),
+    ))
+    db.commit()
+    return token
+
+def rotate_refresh_token(db: Session, token: str):
+    """
+    Exchange a refresh token for a new one. Returns (user, new_token), or
+    None when the token is unknown, expired, revoked or the user is inactive.
+    Presenting an already rotated token revokes every token of that user,
+    since it means the token was replayed. Rotated tokens are kept, revoked,
+    until they expire so that a replay is recognised; the user's expired
+    tokens are deleted here.
+    """
+    stored = db.query(RefreshToken).options(joinedload(RefreshToken.user)).filter(
+        RefreshToken.token_hash == _hash_refresh_token(token)
+    ).first()
+    if stored is None:
+        return None
+    if stored.revoked:
+        revoke_user_refresh_tokens(db, stored.user_id)
+        return None
+    user = stored.user
+    if stored.expires_at < datetime.utcnow() or user is None or not user.is_active:
+        db.delete(stored)
+        db.commit()
+        return None
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    # Claim the token atomically; of concurrent refreshes with it only one gets a row
+    claimed = db.query(RefreshToken).filter(
+        RefreshToken.id == stored.id,
+        RefreshToken.revoked == False  # noqa: E712
+    ).update({RefreshToken.revoked: True}, synchronize_session=False)
+    if claimed != 1:
+        # Another request rotated it first, so this is a second use of the token
+        db.rollback()
+        revoke_user_refresh_tokens(db, stored.user_id)
+        return None
+    db.query(RefreshToken).filter(
+        RefreshToken.user_id == user.id,
+        RefreshToken.expires_at < datetime.utcnow()
+    ).delete(synchronize_session=False)
+    return user, create_refresh_token(db, user)
+
+def revoke_refresh_token(db: Session, token: str) -> bool:
+    """Revoke one token, e.g. on logout; the row is deleted"""
+    deleted = db.query(RefreshToken).filter(
+        RefreshToken.token_hash == _hash_refresh_token(token)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted > 0
+
+def revoke_user_refresh_tokens(db: Session, user_id: int):
+    """Revoke all of a user's tokens by deleting their rows"""
+    db.query(RefreshToken).filter(RefreshToken.user_id == user_id).delete(synchronize_session=False)
+    db.commit()
+
+@tracing.traced("auth.get_current_user")
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = tokens.decode(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
-    except JWTError:
+    except tokens.TokenError:
         raise credentials_exception
+    # Reads after this user's own writes must not hit a lagging replica
+    db.info["sticky_key"] = token_data.username
     user = get_user(db, username=token_data.username)
     if user is None:
         raise credentials_exception
@@ -71,4 +158,94 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def get_current_superuser(current_user: User = Depends(get_current_active_user)):
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Superuser access required")
+    return current_user
+
+# Ids of deactivated or deleted users. Tokens carrying embedded claims are
+# only trusted when their user id is not in this set. It is reloaded every
+# REVOKED_USERS_REFRESH_SECONDS so changes made by other workers or outside
+# the app are seen, and updated when a session of this process commits.
+revoked_user_ids = set()
+# Deleted users are not in the table any more, so reloads keep the ones this process saw
+_deleted_user_ids = set()
+_revoked_loaded_at = 0.0
+
+def load_revoked_users(db: Session):
+    """Reload the revocation set from the database"""
+    global revoked_user_ids, _revoked_loaded_at
+    rows = db.query(User.id).filter(User.is_active == False).all()  # noqa: E712
+    # Swapped in whole so concurrent checks never see a partly filled set
+    revoked_user_ids = {row.id for row in rows} | _deleted_user_ids
+    _revoked_loaded_at = time.monotonic()
+    return len(revoked_user_ids)
+
+def _pending_revocations(target) -> Optional[dict]:
+    session = object_session(target)
+    return session.info.setdefault("revocations", {}) if session is not None else None
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+def _sync_revocation(mapper, connection, target):
+    # Applied once the transaction commits, see _apply_revocations
+    pending = _pending_revocations(target)
+    if pending is not None:
+        pending[target.id] = "active" if target.is_active else "inactive"
+
+@event.listens_for(User, "after_delete")
+def _revoke_deleted_user(mapper, connection, target):
+    pending = _pending_revocations(target)
+    if pending is not None:
+        pending[target.id] = "deleted"
+
+@event.listens_for(Session, "after_commit")
+def _apply_revocations(session):
+    for user_id, state in session.info.pop("revocations", {}).items():
+        if state == "active":
+            revoked_user_ids.discard(user_id)
+        else:
+            revoked_user_ids.add(user_id)
+            if state == "deleted":
+                _deleted_user_ids.add(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_revocations(session):
+    session.info.pop("revocations", None)
+
+@tracing.traced("auth.get_current_token_user")
+async def get_current_token_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db)):
+    """
+    Resolve the caller from the token claims alone when they are embedded,
+    falling back to a database lookup for tokens issued without them.
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = tokens.decode(token)
+        username: str = payload.get("sub")
+        if username is None:
+            raise credentials_exception
+    except tokens.TokenError:
+        raise credentials_exception
+
+    user_id = payload.get("uid")
+    if user_id is not None:
+        if time.monotonic() - _revoked_loaded_at > get_settings().revoked_users_refresh_seconds:
+            load_revoked_users(db)
+        if user_id in revoked_user_ids or not payload.get("active", True):
+            raise HTTPException(status_code=400, detail="Inactive user")
+        return TokenData(username=username, user_id=user_id, is_active=True)
+
+    db.info["sticky_key"] = username
+    user = get_user(db, username=username)
+    if user is None:
+        raise credentials_exception
+    if not user.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return TokenData(username=user.username, user_id=user.id, is_active=user.is_active)
@@ -0,0 +1,196 @@
+"""
+NDJSON export and import of users with their preferences.
+
+Each line is one user:
+
+    {"username": ..., "hashed_password": ..., "is_active": ..., "is_superuser": ...,
+     "preferences": {"theme": ..., "language": ..., "notifications": ...} or null}
+
+Export streams users in id order with yield_per, so memory stays flat at any
+table size. Import upserts by username in batches, one transaction each.
+Preferences are written to the owning shard when sharding is enabled.
+Password hashes are included, so treat the files as secrets.
+
+    python backup.py export [FILE]     # default: stdout
+    python backup.py import [FILE]     # default: stdin
+"""
+
+import json
+import sys
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import models
+import changefeed
+import devices
+from sharding import ring, shard_engines
+
+EXPORT_BATCH_SIZE = 1000
+IMPORT_BATCH_SIZE = 500
+PREFERENCE_FIELDS = ("theme", "language", "notifications")
+
+class InvalidRecord(ValueError):
+    """A line that cannot be imported; earlier batches stay committed"""
+
+def _preferences_for(db: Session, user_ids: List[int]) -> Dict[int, dict]:
+    """Preferences of a batch of users, from the primary or their shards"""
+    def load(session, ids):
+        rows = session.query(models.Preferences).filter(models.Preferences.user_id.in_(ids))
+        return {row.user_id: {field: getattr(row, field) for field in PREFERENCE_FIELDS} for row in rows}
+
+    if ring is None:
+        return load(db, user_ids)
+    by_shard = defaultdict(list)
+    for user_id in user_ids:
+        by_shard[ring.node_for(user_id)].append(user_id)
+    found = {}
+    for url, ids in by_shard.items():
+        with Session(bind=shard_engines[url]) as shard_session:
+            found.update(load(shard_session, ids))
+    return found
+
+def export_records(db: Session, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[dict]:
+    result = db.execute(
+        select(models.User).order_by(models.User.id).execution_options(yield_per=batch_size)
+    )
+    for users in result.scalars().partitions():
+        preferences = _preferences_for(db, [user.id for user in users])
+        for user in users:
+            yield {
+                "username": user.username,
+                "hashed_password": user.hashed_password,
+                "is_active": user.is_active,
+                "is_superuser": user.is_superuser,
+                "preferences": preferences.get(user.id)
+            }
+
+def _upsert_preferences(session: Session, db: Session, items: List[tuple]):
+    """Write (user_id, preferences) pairs through session; change feed entries go to db"""
+    existing = {
+        row.user_id: row for row in session.query(models.Preferences).filter(
+            models.Preferences.user_id.in_([user_id for user_id, _ in items])
+        )
+    }
+    rows = []
+    for user_id, values in items:
+        row = existing.get(user_id)
+        if row is None:
+            row = models.Preferences(user_id=user_id)
+            session.add(row)
+            existing[user_id] = row
+        for field in PREFERENCE_FIELDS:
+            if field in values:
+                setattr(row, field, values[field])
+        rows.append(row)
+    # Device overrides inherit from these rows, so their resolved values follow
+    devices.refresh_many(session, rows)
+    session.flush()
+    for row in rows:
+        changefeed.record_change(db, row)
+
+def import_batch(db: Session, records: List[dict], counts: Dict[str, int]):
+    """Upsert one batch of records by username and commit it"""
+    existing = {
+        user.username: user for user in db.query(models.User).filter(
+            models.User.username.in_([record["username"] for record in records])
+        )
+    }
+    pending = []
+    for record in records:
+        user = existing.get(record["username"])
+        if user is None:
+            user = models.User(username=record["username"])
+            db.add(user)
+            existing[user.username] = user
+            counts["created"] += 1
+        else:
+            counts["updated"] += 1
+        user.hashed_password = record["hashed_password"]
+        user.is_active = record.get("is_active", True)
+        user.is_superuser = record.get("is_superuser", False)
+        if record.get("preferences") is not None:
+            pending.append((user, record["preferences"]))
+    db.flush()
+
+    shard_sessions = {}
+    try:
+        if ring is None:
+            _upsert_preferences(db, db, [(user.id, values) for user, values in pending])
+        else:
+            by_shard = defaultdict(list)
+            for user, values in pending:
+                by_shard[ring.node_for(user.id)].append((user.id, values))
+            for url, items in by_shard.items():
+                shard_sessions[url] = Session(bind=shard_engines[url])
+                _upsert_preferences(shard_sessions[url], db, items)
+        # Users first: a failure after this leaves users on default preferences, never orphaned rows
+        db.commit()
+        for shard_session in shard_sessions.values():
+            shard_session.commit()
+    finally:
+        for shard_session in shard_sessions.values():
+            shard_session.close()
+    changefeed.notify_waiters()
+
+def parse_line(line, line_number: int):
+    """Decode one NDJSON line; blank lines give None"""
+    if not line.strip():
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise InvalidRecord(f"Line {line_number}: invalid JSON ({e})")
+    if not isinstance(record, dict) or not record.get("username") or not record.get("hashed_password"):
+        raise InvalidRecord(f"Line {line_number}: username and hashed_password are required")
+    return record
+
+def import_lines(db: Session, lines: Iterable, batch_size: int = IMPORT_BATCH_SIZE, progress=None) -> Dict[str, int]:
+    counts = {"created": 0, "updated": 0}
+    batch = []
+    for line_number, line in enumerate(lines, 1):
+        record = parse_line(line, line_number)
+        if record is not None:
+            batch.append(record)
+        if len(batch) >= batch_size:
+            import_batch(db, batch, counts)
+            batch = []
+            if progress:
+                progress(counts)
+    if batch:
+        import_batch(db, batch, counts)
+        if progress:
+            progress(counts)
+    return counts
+
+if __name__ == "__main__":
+    from database import SessionLocal
+    from serialization import dumps
+    # Keep the stats counters in step with imported rows
+    import stats  # noqa: F401
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ("export", "import"):
+        print("Usage: python backup.py export [FILE] | import [FILE]")
+        sys.exit(1)
+    path = sys.argv[2] if len(sys.argv) > 2 and sys.argv[2] != "-" else None
+    db = SessionLocal()
+    try:
+        if sys.argv[1] == "export":
+            out = open(path, "wb") if path else sys.stdout.buffer
+            exported = 0
+            for record in export_records(db):
+                out.write(dumps(record) + b"\n")
+                exported += 1
+            out.flush()
+            print(f"Exported {exported} user(s)", file=sys.stderr)
+        else:
+            source = open(path, encoding="utf-8") if path else sys.stdin
+            def report(counts):
+                print(f"Imported {counts['created'] + counts['updated']} user(s)...", file=sys.stderr)
+            counts = import_lines(db, source, progress=report)
+            print(f"Created {counts['created']}, updated {counts['updated']} user(s)", file=sys.stderr)
+    except InvalidRecord as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        db.close()
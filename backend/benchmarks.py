@@ -0,0 +1,176 @@
+"""
+Microbenchmarks for the functions on every request.
+
+    python benchmarks.py              # run and compare with the saved baseline
+    python benchmarks.py --save       # run and store the results as the new baseline
+    python benchmarks.py -k token     # only benchmarks whose name contains "token"
+
+Everything runs against the in-memory fixtures database, never app.db.
+Baselines depend on the machine, so they are kept out of git in
+benchmark_baseline.json (or BENCHMARK_BASELINE). Results more than 10% slower
+than the baseline are flagged and the exit status is 1.
+"""
+
+import fixtures  # Must come first: points the app at the in-memory database
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from datetime import timedelta
+import auth
+import main
+import passwords
+import schemas
+import tokens
+from config import get_settings
+from database import ReadSessionLocal
+from serialization import dumps, preferences_to_dict
+
+BASELINE_PATH = os.getenv(
+    "BENCHMARK_BASELINE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+)
+REGRESSION_THRESHOLD = 0.10
+SAMPLES = 5
+SAMPLE_SECONDS = 0.2
+
+_benchmarks = []
+
+def benchmark(name: str):
+    """Register a function that returns the callable to time"""
+    def register(setup):
+        _benchmarks.append((name, setup))
+        return setup
+    return register
+
+def measure(fn) -> float:
+    """Best seconds per call over SAMPLES samples of about SAMPLE_SECONDS each; the minimum is least affected by noise"""
+    started = time.perf_counter()
+    fn()
+    calls = max(1, int(SAMPLE_SECONDS / max(time.perf_counter() - started, 1e-9)))
+    samples = []
+    for _ in range(SAMPLES):
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        samples.append((time.perf_counter() - started) / calls)
+    return min(samples)
+
+def _run_async(coroutine_fn):
+    loop = asyncio.new_event_loop()
+    return lambda: loop.run_until_complete(coroutine_fn())
+
+db = fixtures.session()
+user = fixtures.create_user(db, "benchmark-user", theme="dark")
+settings = get_settings()
+token = auth.create_access_token(auth.token_claims_for(user), timedelta(minutes=30))
+
+@benchmark("auth.create_access_token")
+def _create_access_token():
+    claims = auth.token_claims_for(user)
+    return lambda: auth.create_access_token(claims, timedelta(minutes=30))
+
+@benchmark(f"jwt decode ({settings.jwt_backend})")
+def _jwt_decode():
+    return lambda: tokens.backend().decode(token, settings.secret_key, settings.algorithm)
+
+@benchmark("tokens.decode (cached)")
+def _cached_decode():
+    return lambda: tokens.decode(token)
+
+@benchmark("auth.get_current_user")
+def _get_current_user():
+    read_db = ReadSessionLocal()
+    return _run_async(lambda: auth.get_current_user(token, read_db))
+
+@benchmark("passwords.verify")
+def _verify_password():
+    hashed = auth.get_password_hash("password")
+    return lambda: auth.verify_password("password", hashed)
+
+@benchmark("passwords.hash_password")
+def _hash_password():
+    return lambda: auth.get_password_hash("password")
+
+@benchmark("schemas.Preferences from ORM")
+def _preferences_schema():
+    preferences = user.preferences
+    return lambda: schemas.Preferences.model_validate(preferences, from_attributes=True).model_dump_json()
+
+@benchmark("preferences_to_dict + dumps")
+def _preferences_fast_path():
+    preferences = user.preferences
+    return lambda: dumps(preferences_to_dict(preferences))
+
+def _fan_out(sockets: int, users: int):
+    def setup():
+        for client_id in list(main.connected_clients):
+            main.unregister_client(client_id)
+        fixtures.register_fake_sockets(main.register_client, sockets, users)
+        payload = preferences_to_dict(user.preferences)
+        return _run_async(lambda: main.notify_clients(1, payload))
+    return setup
+
+for count, label in ((1000, "1k"), (10000, "10k"), (50000, "50k")):
+    # Every socket belongs to the notified user
+    benchmark(f"notify_clients fan-out {label}")(_fan_out(count, 1))
+# One user's 5 sockets among 50k registered for 10k users
+benchmark("notify_clients 5 of 50k")(_fan_out(50000, 10000))
+
+@benchmark("broadcast to everyone 50k")
+def _broadcast_everyone():
+    for client_id in list(main.connected_clients):
+        main.unregister_client(client_id)
+    fixtures.register_fake_sockets(main.register_client, 50000, 10000)
+    client_ids = list(main.connected_clients)
+    return _run_async(lambda: main.broadcast_to_clients(client_ids, {"topic": None, "message": "maintenance"}))
+
+def _format(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Run the microbenchmarks")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("-k", dest="pattern", default="", help="only run benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    passwords.configure()
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f).get("results", {})
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':34} {'per call':>12} {'calls/s':>12} {'baseline':>12} {'change':>8}")
+    for name, setup in _benchmarks:
+        if args.pattern not in name:
+            continue
+        seconds = measure(setup())
+        results[name] = seconds
+        line = f"{name:34} {_format(seconds):>12} {1 / seconds:>12,.0f}"
+        if name in baseline:
+            change = seconds / baseline[name] - 1
+            flag = "  REGRESSION" if change > REGRESSION_THRESHOLD else ""
+            line += f" {_format(baseline[name]):>12} {change:>+8.1%}{flag}"
+            if flag:
+                regressions.append(name)
+        print(line)
+
+    if args.save:
+        saved = dict(baseline, **results)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": saved}, f, indent=2)
+        print(f"Saved baseline to {BASELINE_PATH}")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) slower than baseline by more than {REGRESSION_THRESHOLD:.0%}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_cli()
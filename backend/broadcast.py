@@ -0,0 +1,77 @@
+"""
+Sending one message to many sockets.
+
+The caller encodes the message once. At most BROADCAST_CONCURRENCY sends run
+at a time, on a fixed set of worker tasks that take sockets from a shared
+iterator, so 100k sockets do not mean 100k tasks. A slow socket holds up only
+its own worker. A send that fails or exceeds BROADCAST_SEND_TIMEOUT_SECONDS
+counts as dropped: the socket is handed to on_drop to be unregistered and
+closed with 1013 (try again later), so the client reconnects and resyncs
+instead of silently missing messages.
+"""
+
+import asyncio
+import time
+from typing import Callable, List, Tuple
+from config import get_settings
+from sse import SSEConnection
+
+# One topic name, and the comma-separated list a socket subscribes with
+TOPIC_PATTERN = r"^[A-Za-z0-9_.-]{1,64}$"
+TOPICS_PATTERN = r"^[A-Za-z0-9_.-]{1,64}(,[A-Za-z0-9_.-]{1,64}){0,19}$"
+
+# Close code telling a dropped client to reconnect later
+DROPPED_CLOSE_CODE = 1013
+# Closes in progress; asyncio keeps only weak references to tasks
+_closing = set()
+
+def parse_topics(topics: str) -> Tuple[str, ...]:
+    return tuple(dict.fromkeys(topic for topic in topics.split(",") if topic)) if topics else ()
+
+async def _close(connection):
+    try:
+        # A peer that stopped reading may never take the close frame either
+        await asyncio.wait_for(connection.close(DROPPED_CLOSE_CODE), get_settings().broadcast_send_timeout_seconds)
+    except Exception:
+        pass
+
+def _drop(client_id: str, connection, on_drop: Callable[[str], None]):
+    on_drop(client_id)
+    task = asyncio.ensure_future(_close(connection))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+async def send_all(targets: List[tuple], message: str, on_drop: Callable[[str], None]) -> dict:
+    """
+    Send message to every (client_id, connection) in targets.
+    Returns counts of targeted, delivered and dropped sockets and the duration.
+    """
+    settings = get_settings()
+    started = time.perf_counter()
+    remaining = iter(targets)
+    delivered = dropped = 0
+
+    async def worker():
+        nonlocal delivered, dropped
+        for client_id, connection in remaining:
+            try:
+                if isinstance(connection, SSEConnection):
+                    # Queued without waiting; a full buffer raises
+                    connection.push(message)
+                else:
+                    # The timeout covers this send only, so it cannot fire once the send is done
+                    await asyncio.wait_for(connection.send_text(message), settings.broadcast_send_timeout_seconds)
+                delivered += 1
+            except Exception:
+                # Includes TimeoutError from a send that took too long
+                dropped += 1
+                _drop(client_id, connection, on_drop)
+
+    workers = min(settings.broadcast_concurrency, len(targets))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return {
+        "targeted": len(targets),
+        "delivered": delivered,
+        "dropped": dropped,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3)
+    }
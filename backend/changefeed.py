@@ -0,0 +1,120 @@
+"""
+Durable feed of preference changes.
+
+Every preferences write appends a full snapshot to preference_changes in the
+same transaction. Consumers page through it with GET /preferences/changes
+using the last id they saw as the cursor.
+
+Because each entry is a full snapshot, superseded entries can be dropped
+without losing the current state of any user:
+
+    python changefeed.py compact
+"""
+
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from config import get_settings
+import models
+
+# Resolved when a change is recorded in this process, to wake long-polls early.
+# Writers run in the threadpool as well as on the event loop, hence the lock.
+_waiters = set()
+_waiters_lock = threading.Lock()
+
+def record_change(db: Session, preferences: models.Preferences):
+    """Append a snapshot of the row; committed together with the caller's update"""
+    change = models.PreferenceChange(
+        user_id=preferences.user_id,
+        theme=preferences.theme,
+        language=preferences.language,
+        notifications=preferences.notifications,
+    )
+    db.add(change)
+    return change
+
+def notify_waiters():
+    """Wake long-polls after a change has been committed; safe to call from any thread"""
+    global _waiters
+    with _waiters_lock:
+        waiters, _waiters = _waiters, set()
+    for waiter in waiters:
+        loop = waiter.get_loop()
+        if not loop.is_closed():
+            # Futures may only be resolved on their own loop's thread
+            loop.call_soon_threadsafe(_wake, waiter)
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+def list_changes(db: Session, since: int, limit: int, user_id: Optional[int] = None) -> List[models.PreferenceChange]:
+    query = db.query(models.PreferenceChange).filter(models.PreferenceChange.id > since)
+    if user_id is not None:
+        query = query.filter(models.PreferenceChange.user_id == user_id)
+    return query.order_by(models.PreferenceChange.id).limit(limit).all()
+
+async def wait_for_change(timeout: float):
+    """
+    Wait until a change is recorded in this process or the timeout passes.
+    Callers re-query afterwards, so changes made by other workers are picked
+    up on the next poll.
+    """
+    waiter = asyncio.get_running_loop().create_future()
+    with _waiters_lock:
+        _waiters.add(waiter)
+    try:
+        await asyncio.wait_for(waiter, timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        with _waiters_lock:
+            _waiters.discard(waiter)
+
+def latest_change_after(db: Session, user_id: int, since: int) -> Optional[int]:
+    """Cursor of the user's newest change after since, if there is one"""
+    return db.query(func.max(models.PreferenceChange.id)).filter(
+        models.PreferenceChange.user_id == user_id,
+        models.PreferenceChange.id > since
+    ).scalar()
+
+def change_to_dict(change: models.PreferenceChange) -> dict:
+    return {
+        "cursor": change.id,
+        "user_id": change.user_id,
+        "theme": change.theme,
+        "language": change.language,
+        "notifications": change.notifications,
+        "changed_at": change.changed_at.isoformat()
+    }
+
+def compact(db: Session, retention_days: Optional[int] = None) -> int:
+    """
+    Delete entries older than the retention window that a newer entry for the
+    same user supersedes. The latest entry per user is always kept.
+    """
+    if retention_days is None:
+        retention_days = get_settings().preference_changes_retention_days
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    latest = select(func.max(models.PreferenceChange.id)).group_by(models.PreferenceChange.user_id)
+    deleted = db.query(models.PreferenceChange).filter(
+        models.PreferenceChange.changed_at < cutoff,
+        models.PreferenceChange.id.not_in(latest)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+if __name__ == "__main__":
+    import sys
+    from database import SessionLocal
+    if len(sys.argv) < 2 or sys.argv[1] != "compact":
+        print("Usage: python changefeed.py compact")
+        sys.exit(1)
+    db = SessionLocal()
+    try:
+        print(f"Removed {compact(db)} superseded change(s)")
+    finally:
+        db.close()
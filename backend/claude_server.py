@@ -4,21 +4,16 @@ This FastMCP server provides tools for Claude to interact with the preferences A
 """
 
 from fastmcp import FastMCP, Context
-import httpx
-import os
 from typing import Optional, Literal
 from pydantic import BaseModel
+from config import get_settings
+from mcp_sessions import api_client, api_request, session_key, sessions
 
 # Create a FastMCP server
 mcp = FastMCP("Preferences Assistant")
 
-# API settings
-API_URL = os.getenv("API_URL", "http://localhost:8000")
-HEADERS = {"Content-Type": "application/json"}
-
-# Auth token storage (Note: In production, use a more secure method)
-# This is a simple way to maintain token between calls in the same session
-AUTH_TOKEN = None
+# Credentials are stored per MCP session, so one process serves many users
+# (Note: tokens are held in memory only and are lost on restart)
 
 
 class PreferencesUpdate(BaseModel):
@@ -29,24 +24,26 @@ class PreferencesUpdate(BaseModel):
 
 
 @mcp.tool()
-async def login(username: str, password: str) -> dict:
+async def login(username: str, password: str, ctx: Context = None) -> dict:
     """
     Login to the preferences system with username and password.
     Returns authentication status and message.
     """
-    global AUTH_TOKEN
+    credentials = sessions.get(session_key(ctx))
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Call the login API endpoint
             response = await client.post(
-                f"{API_URL}/auth/login",
+                f"{get_settings().api_url}/auth/login",
                 data={"username": username, "password": password}
             )
             
             if response.status_code == 200:
                 data = response.json()
-                AUTH_TOKEN = data["access_token"]
+                credentials.access_token = data["access_token"]
+                # Lets api_request renew the access token when it expires
+                credentials.refresh_token = data.get("refresh_token")
                 return {
                     "status": "success",
                     "message": "Login successful. You can now check or update your preferences."
@@ -69,7 +66,8 @@ async def get_preferences(ctx: Context) -> dict:
     Get the current user preferences.
     User must be logged in first.
     """
-    if not AUTH_TOKEN:
+    credentials = sessions.get(session_key(ctx))
+    if not credentials.access_token:
         return {
             "status": "error",
             "message": "You need to login first. Please use the login tool."
@@ -77,13 +75,10 @@ async def get_preferences(ctx: Context) -> dict:
     
     await ctx.info("Fetching user preferences...")
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Call the preferences API endpoint with auth token
-            response = await client.get(
-                f"{API_URL}/preferences",
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "GET", "/preferences")
             
             if response.status_code == 200:
                 preferences = response.json()
@@ -116,7 +111,8 @@ async def update_theme(theme: Literal["light", "dark"], ctx: Context) -> dict:
     Update the user's theme preference.
     User must be logged in first.
     """
-    if not AUTH_TOKEN:
+    credentials = sessions.get(session_key(ctx))
+    if not credentials.access_token:
         return {
             "status": "error",
             "message": "You need to login first. Please use the login tool."
@@ -124,14 +120,10 @@ async def update_theme(theme: Literal["light", "dark"], ctx: Context) -> dict:
     
     await ctx.info(f"Updating theme to {theme}...")
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Call the preferences API endpoint with auth token
-            response = await client.post(
-                f"{API_URL}/preferences",
-                json={"theme": theme},
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "POST", "/preferences", json={"theme": theme})
             
             if response.status_code == 200:
                 return {
@@ -159,7 +151,8 @@ async def update_language(language: str, ctx: Context) -> dict:
     Common languages: english, spanish, french, german, etc.
     User must be logged in first.
     """
-    if not AUTH_TOKEN:
+    credentials = sessions.get(session_key(ctx))
+    if not credentials.access_token:
         return {
             "status": "error",
             "message": "You need to login first. Please use the login tool."
@@ -167,14 +160,10 @@ async def update_language(language: str, ctx: Context) -> dict:
     
     await ctx.info(f"Updating language to {language}...")
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Call the preferences API endpoint with auth token
-            response = await client.post(
-                f"{API_URL}/preferences",
-                json={"language": language.lower()},
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "POST", "/preferences", json={"language": language.lower()})
             
             if response.status_code == 200:
                 return {
@@ -201,7 +190,8 @@ async def toggle_notifications(enabled: bool, ctx: Context) -> dict:
     Enable or disable notifications.
     User must be logged in first.
     """
-    if not AUTH_TOKEN:
+    credentials = sessions.get(session_key(ctx))
+    if not credentials.access_token:
         return {
             "status": "error",
             "message": "You need to login first. Please use the login tool."
@@ -209,14 +199,10 @@ async def toggle_notifications(enabled: bool, ctx: Context) -> dict:
     
     await ctx.info(f"{'Enabling' if enabled else 'Disabling'} notifications...")
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Call the preferences API endpoint with auth token
-            response = await client.post(
-                f"{API_URL}/preferences",
-                json={"notifications": enabled},
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "POST", "/preferences", json={"notifications": enabled})
             
             if response.status_code == 200:
                 status = "enabled" if enabled else "disabled"
@@ -243,14 +229,15 @@ async def update_all_preferences(
     theme: Optional[Literal["light", "dark"]] = None,
     language: Optional[str] = None,
     notifications: Optional[bool] = None,
-    ctx: Context = Context()
+    ctx: Context = None
 ) -> dict:
     """
     Update multiple preferences at once.
     Set any preference to None to keep its current value.
     User must be logged in first.
     """
-    if not AUTH_TOKEN:
+    credentials = sessions.get(session_key(ctx))
+    if not credentials.access_token:
         return {
             "status": "error",
             "message": "You need to login first. Please use the login tool."
@@ -273,14 +260,10 @@ async def update_all_preferences(
             "message": "No preferences specified to update."
         }
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Call the preferences API endpoint with auth token
-            response = await client.post(
-                f"{API_URL}/preferences",
-                json=update_data,
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "POST", "/preferences", json=update_data)
             
             if response.status_code == 200:
                 # Build response message
@@ -314,22 +297,20 @@ async def update_all_preferences(
 
 
 @mcp.tool()
-async def validate_token() -> dict:
+async def validate_token(ctx: Context = None) -> dict:
     """
     Check if the current auth token is valid.
     """
-    if not AUTH_TOKEN:
+    credentials = sessions.get(session_key(ctx))
+    if not credentials.access_token:
         return {
             "status": "error",
             "message": "No authentication token available. Please login first."
         }
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
-            response = await client.get(
-                f"{API_URL}/auth/validate-token",
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "GET", "/auth/validate-token")
             
             if response.status_code == 200:
                 return {
@@ -0,0 +1,61 @@
+"""
+Coalescing of bursts of updates to the same key.
+The first update for a key opens a short window; updates that arrive before
+it closes are merged, applied once, and every caller gets the same result.
+"""
+
+import asyncio
+import functools
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+class _Batch:
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.changes: Dict[str, Any] = {}
+        self.callers = 0
+
+class UpdateCoalescer:
+    def __init__(self, window_seconds: float, apply: Callable[[Hashable, dict], Awaitable[Any]]):
+        self.window_seconds = window_seconds
+        self._apply = apply
+        self._pending: Dict[Hashable, _Batch] = {}
+        # Flushes in progress; asyncio keeps only weak references to tasks
+        self._tasks = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_seconds > 0
+
+    async def submit(self, key: Hashable, changes: dict) -> Any:
+        """Merge changes into the open batch for key and wait for it to be applied"""
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = _Batch(asyncio.get_running_loop().create_future())
+            # Callers await it through shield, so an error nobody is left waiting for is still retrieved
+            batch.future.add_done_callback(lambda future: future.cancelled() or future.exception())
+            self._pending[key] = batch
+            task = asyncio.create_task(self._flush_later(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(functools.partial(self._flush_done, key, batch))
+        # Later changes win for the same field
+        batch.changes.update(changes)
+        batch.callers += 1
+        return await asyncio.shield(batch.future)
+
+    async def _flush_later(self, key: Hashable, batch: _Batch):
+        await asyncio.sleep(self.window_seconds)
+        # Close the window before applying so new updates start a fresh batch
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+        try:
+            batch.future.set_result(await self._apply(key, batch.changes))
+        except Exception as e:
+            batch.future.set_exception(e)
+
+    def _flush_done(self, key: Hashable, batch: _Batch, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not batch.future.done():
+            # The flush was cancelled, e.g. at shutdown; do not leave callers waiting
+            if self._pending.get(key) is batch:
+                del self._pending[key]
+            batch.future.cancel()
@@ -0,0 +1,111 @@
+"""
+Application settings.
+The .env file and environment are read once, on first access to get_settings().
+"""
+
+import os
+from functools import lru_cache
+from dotenv import load_dotenv
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+class Settings:
+    def __init__(self):
+        # Load environment variables
+        load_dotenv()
+
+        # Security settings
+        self.secret_key = os.getenv("SECRET_KEY")
+        self.algorithm = os.getenv("ALGORITHM")
+        self.access_token_expire_minutes = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+        self.refresh_token_expire_days = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
+        # "jose" (python-jose) or "pyjwt"
+        self.jwt_backend = os.getenv("JWT_BACKEND", "jose").lower()
+        # Verified tokens remembered until they expire, so repeat requests skip the signature check
+        self.token_cache_size = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+        # Embed user id and active flag in access tokens so validation can skip the DB
+        self.embed_user_claims = _env_bool("JWT_EMBED_USER_CLAIMS", "false")
+        # How often each worker reloads deactivated users for tokens with embedded claims
+        self.revoked_users_refresh_seconds = float(os.getenv("REVOKED_USERS_REFRESH_SECONDS", "5"))
+
+        # Password hashing: "bcrypt" or "argon2". The cost is calibrated at startup to take
+        # about PASSWORD_HASH_TARGET_MS per hash unless PASSWORD_HASH_ROUNDS pins it
+        self.password_scheme = os.getenv("PASSWORD_SCHEME", "bcrypt").lower()
+        self.password_hash_target_ms = float(os.getenv("PASSWORD_HASH_TARGET_MS", "250"))
+        self.password_hash_rounds = int(os.getenv("PASSWORD_HASH_ROUNDS", "0"))
+        self.argon2_memory_kib = int(os.getenv("ARGON2_MEMORY_KIB", "19456"))
+
+        # Database
+        self.database_url = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+        # Optional read replica for read-only handlers and auth lookups
+        self.database_replica_url = os.getenv("DATABASE_REPLICA_URL") or None
+        # After a write, that user's reads stay on the primary for this long
+        self.read_your_writes_seconds = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+        # Optional comma-separated database URLs that the preferences table is sharded across
+        self.preferences_shard_urls = [
+            url.strip() for url in os.getenv("PREFERENCES_SHARD_URLS", "").split(",") if url.strip()
+        ]
+        # Create missing tables when the app starts; disable when running migrate.py separately
+        self.auto_migrate = _env_bool("AUTO_MIGRATE", "true")
+
+        # Bloom filter behind /auth/username-available: expected users, and how often
+        # users registered by other workers are picked up
+        self.username_filter_capacity = int(os.getenv("USERNAME_FILTER_CAPACITY", "100000"))
+        self.username_filter_refresh_seconds = float(os.getenv("USERNAME_FILTER_REFRESH_SECONDS", "5"))
+
+        # Merge a user's preference updates arriving within this many ms (0 disables)
+        self.preferences_coalesce_ms = float(os.getenv("PREFERENCES_COALESCE_MS", "0"))
+
+        # Superseded preference changes older than this are removed by changefeed.py compact
+        self.preference_changes_retention_days = int(os.getenv("PREFERENCE_CHANGES_RETENTION_DAYS", "30"))
+
+        # Notification inbox: notifications kept per user, days before inbox.py prune
+        # removes them, and how many unacknowledged ones a socket gets on connect
+        self.notification_inbox_limit = int(os.getenv("NOTIFICATION_INBOX_LIMIT", "500"))
+        self.notification_retention_days = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "30"))
+        self.notification_backfill_limit = int(os.getenv("NOTIFICATION_BACKFILL_LIMIT", "100"))
+
+        # POST /admin/broadcast: sends in flight at once, and how long one socket may take
+        self.broadcast_concurrency = max(1, int(os.getenv("BROADCAST_CONCURRENCY", "100")))
+        self.broadcast_send_timeout_seconds = float(os.getenv("BROADCAST_SEND_TIMEOUT_SECONDS", "5"))
+
+        # Server-Sent Events: queued events per connection, and idle heartbeat interval
+        self.sse_buffer_size = int(os.getenv("SSE_BUFFER_SIZE", "100"))
+        self.sse_heartbeat_seconds = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+        # Serve the MCP tools from the API process at this path (e.g. /mcp); empty disables
+        self.mcp_mount_path = os.getenv("MCP_MOUNT_PATH", "").rstrip("/")
+        # Base URL the MCP servers call the API at, and "asgi" to call it in-process instead
+        self.api_url = os.getenv("API_URL", "http://localhost:8000").rstrip("/")
+        self.mcp_api_transport = os.getenv("MCP_API_TRANSPORT", "http").lower()
+        # MCP calls to the API: total time budget per call, retries of read-only calls,
+        # and consecutive failures that open the circuit breaker and for how long
+        self.mcp_api_timeout_seconds = float(os.getenv("MCP_API_TIMEOUT_SECONDS", "5"))
+        self.mcp_api_retries = int(os.getenv("MCP_API_RETRIES", "2"))
+        self.mcp_breaker_failures = int(os.getenv("MCP_BREAKER_FAILURES", "5"))
+        self.mcp_breaker_reset_seconds = float(os.getenv("MCP_BREAKER_RESET_SECONDS", "15"))
+        # MCP sessions whose credentials are kept, and seconds of inactivity before they are dropped
+        self.mcp_max_sessions = int(os.getenv("MCP_MAX_SESSIONS", "1000"))
+        self.mcp_session_ttl_seconds = int(os.getenv("MCP_SESSION_TTL_SECONDS", "43200"))
+
+        # Write OTLP/JSON trace spans to this file (empty disables tracing), sampling
+        # this fraction of new traces; shared by the API and the MCP server
+        self.trace_file = os.getenv("TRACE_FILE", "")
+        self.trace_sample_ratio = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
+
+        # "orjson" (default) or "json" to force the stdlib encoder
+        self.json_serializer = os.getenv("JSON_SERIALIZER", "orjson").lower()
+
+        # Server (used by server.py)
+        self.host = os.getenv("HOST", "127.0.0.1")
+        self.port = int(os.getenv("PORT", "8000"))
+        self.workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+        self.graceful_shutdown_timeout = int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "10"))
+        # WebSocket clients are told to reconnect after a random delay in this range
+        self.reconnect_min_ms = int(os.getenv("WS_RECONNECT_MIN_MS", "1000"))
+        self.reconnect_max_ms = int(os.getenv("WS_RECONNECT_MAX_MS", "10000"))
+
+@lru_cache()
+def get_settings() -> Settings:
+    return Settings()
@@ -1,26 +1,140 @@
-import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
+import time
+from contextvars import ContextVar
+from typing import Optional
+from fastapi import Request
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from config import get_settings
+from sharding import create_engine_for, is_sharded, shard_engine_for
 
-# Load environment variables
-load_dotenv()
+settings = get_settings()
 
-# Get database URL from environment variables
-SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+# Get database URL from settings
+SQLALCHEMY_DATABASE_URL = settings.database_url
+SQLALCHEMY_REPLICA_URL = settings.database_replica_url
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_engine_for(SQLALCHEMY_DATABASE_URL)
+replica_engine = create_engine_for(SQLALCHEMY_REPLICA_URL) if SQLALCHEMY_REPLICA_URL else None
+
+class ShardedSession(Session):
+    """
+    Session that sends sharded tables to the shard owning info["shard_key"]
+    (a user id, see set_shard_key). Without sharding it behaves like Session.
+    """
+
+    def _shard_bind(self, mapper):
+        if not is_sharded(mapper):
+            return None
+        user_id = self.info.get("shard_key")
+        if user_id is None:
+            raise RuntimeError(f"{mapper.class_.__name__} is sharded; call set_shard_key() first")
+        return shard_engine_for(user_id)
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        return self._shard_bind(mapper) or super().get_bind(mapper=mapper, clause=clause, **kw)
+
+def set_shard_key(db: Session, user_id: int):
+    """Route this session's sharded queries to the given user's shard"""
+    db.info["shard_key"] = user_id
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=ShardedSession)
 
 Base = declarative_base()
 
+# Last write time per user (username), for read-your-writes stickiness
+_recent_writes = {}
+# Set on responses to requests that wrote, so the client's next reads stay on
+# the primary whichever worker serves them
+RECENT_WRITE_COOKIE = "recent_write"
+# Per request, set by ReadYourWritesMiddleware. A mutable holder, because sync
+# handlers run on a copy of the context and could not rebind the variable.
+_request_writes: ContextVar[Optional[dict]] = ContextVar("request_writes", default=None)
+
+def mark_recent_write(key: str):
+    """Keep this user's reads on the primary for the read-your-writes window"""
+    now = time.monotonic()
+    _recent_writes[key] = now
+    if len(_recent_writes) > 10000:
+        cutoff = now - settings.read_your_writes_seconds
+        for stale in [k for k, t in _recent_writes.items() if t < cutoff]:
+            del _recent_writes[stale]
+    request_writes = _request_writes.get()
+    if request_writes is not None:
+        request_writes["wrote"] = True
+
+def wrote_recently(key: str) -> bool:
+    written_at = _recent_writes.get(key)
+    return written_at is not None and time.monotonic() - written_at < settings.read_your_writes_seconds
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware adding the recent-write cookie to responses of requests
+    that called mark_recent_write. It expires with the read-your-writes window.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or replica_engine is None:
+            await self.app(scope, receive, send)
+            return
+        request_writes = {}
+        token = _request_writes.set(request_writes)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and request_writes:
+                cookie = (
+                    f"{RECENT_WRITE_COOKIE}=1; Max-Age={max(1, round(settings.read_your_writes_seconds))}; "
+                    "Path=/; HttpOnly; SameSite=Lax"
+                )
+                message["headers"] = [*message.get("headers", []), (b"set-cookie", cookie.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            _request_writes.reset(token)
+
+class RoutingSession(ShardedSession):
+    """
+    Session that reads from the replica and writes to the primary.
+    Set info["sticky_key"] to the caller's username so their reads go to the
+    primary shortly after they wrote. Once the session flushes, it stays on
+    the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        shard = self._shard_bind(mapper)
+        if shard is not None:
+            return shard
+        if replica_engine is None or self.info.get("use_primary"):
+            return engine
+        if self._flushing:
+            self.info["use_primary"] = True
+            return engine
+        key = self.info.get("sticky_key")
+        if key is not None and wrote_recently(key):
+            return engine
+        return replica_engine
+
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, class_=RoutingSession)
+
 # Dependency to get DB session
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Dependency for read-mostly handlers; uses the replica when one is configured,
+# unless the client wrote recently, possibly through another worker
+def get_read_db(request: Request):
+    db = ReadSessionLocal()
+    if request.cookies.get(RECENT_WRITE_COOKIE):
+        db.info["use_primary"] = True
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,84 @@
+"""
+Per-device preference overrides.
+
+A device row holds optional overrides over the user's preferences plus the
+resolved values, recomputed whenever either side is written. Reading a
+device's effective preferences is one lookup on (user_id, device).
+"""
+
+from typing import Dict, Optional
+from sqlalchemy.orm import Session
+import models
+
+FIELDS = ("theme", "language", "notifications")
+# Accepted device names, e.g. "mobile", "desktop", "tablet-2"
+DEVICE_PATTERN = r"^[A-Za-z0-9_-]{1,32}$"
+
+def resolve(row: models.DevicePreferences, preferences: models.Preferences) -> bool:
+    """Recompute the resolved values of row; returns whether any changed"""
+    changed = False
+    for field in FIELDS:
+        override = getattr(row, field)
+        value = override if override is not None else getattr(preferences, field)
+        if getattr(row, f"resolved_{field}") != value:
+            setattr(row, f"resolved_{field}", value)
+            changed = True
+    return changed
+
+def device_to_dict(row: models.DevicePreferences) -> dict:
+    return {
+        "id": row.id,
+        "user_id": row.user_id,
+        "device": row.device,
+        "theme": row.resolved_theme,
+        "language": row.resolved_language,
+        "notifications": row.resolved_notifications,
+        "overrides": {field: getattr(row, field) for field in FIELDS if getattr(row, field) is not None}
+    }
+
+def get_device(db: Session, user_id: int, device: str) -> Optional[models.DevicePreferences]:
+    """Caller sets the shard key"""
+    return db.query(models.DevicePreferences).filter(
+        models.DevicePreferences.user_id == user_id,
+        models.DevicePreferences.device == device
+    ).first()
+
+def list_devices(db: Session, user_id: int):
+    return db.query(models.DevicePreferences).filter(
+        models.DevicePreferences.user_id == user_id
+    ).order_by(models.DevicePreferences.device).all()
+
+def refresh_devices(db: Session, preferences: models.Preferences) -> Dict[str, Optional[dict]]:
+    """
+    Re-resolve every device of the user after their preferences changed.
+    Maps each device to its new view, or None when its view did not change.
+    """
+    views = {}
+    for row in list_devices(db, preferences.user_id):
+        views[row.device] = device_to_dict(row) if resolve(row, preferences) else None
+    return views
+
+def apply_device_update(db: Session, preferences: models.Preferences, device: str, changes: dict) -> models.DevicePreferences:
+    """
+    Set or clear (None) overrides for one device; the caller commits.
+    preferences is the user's row, used to resolve inherited values.
+    """
+    row = get_device(db, preferences.user_id, device)
+    if row is None:
+        row = models.DevicePreferences(user_id=preferences.user_id, device=device)
+        db.add(row)
+    for field, value in changes.items():
+        if field in FIELDS:
+            setattr(row, field, value)
+    resolve(row, preferences)
+    return row
+
+def refresh_many(db: Session, preferences_rows) -> int:
+    """Re-resolve the devices of many users at once, e.g. after an import"""
+    by_user = {preferences.user_id: preferences for preferences in preferences_rows}
+    if not by_user:
+        return 0
+    rows = db.query(models.DevicePreferences).filter(
+        models.DevicePreferences.user_id.in_(list(by_user))
+    ).all()
+    return sum(resolve(row, by_user[row.user_id]) for row in rows)
@@ -0,0 +1,65 @@
+"""
+Shared fixtures for benchmarks and tests.
+
+Importing this module points the app at an in-memory SQLite database
+(StaticPool, so every session and thread sees the same data) and creates the
+schema. Import it before main, auth or database:
+
+    import fixtures
+    db = fixtures.session()
+    user = fixtures.create_user(db, "alice")
+"""
+
+import os
+
+# Must happen before config, database or sharding are imported
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["DATABASE_REPLICA_URL"] = ""
+os.environ["PREFERENCES_SHARD_URLS"] = ""
+os.environ.setdefault("SECRET_KEY", "fixtures-secret-key-for-benchmarks-only")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from config import get_settings
+get_settings.cache_clear()
+
+import models
+from database import SessionLocal
+from migrate import ensure_schema
+
+ensure_schema()
+
+# Precomputed bcrypt hash of "password" at cost 4, so seeding skips slow hashing
+PASSWORD_HASH = "$2b$04$7dlJretJgxTWcm98JZqPz.QU6YjBtzw6dmie3cR8.IBGAVowpqHzK"
+
+def session():
+    return SessionLocal()
+
+def create_user(db, username: str, with_preferences: bool = True, **preferences) -> models.User:
+    user = models.User(username=username, hashed_password=PASSWORD_HASH)
+    if with_preferences:
+        user.preferences = models.Preferences(**preferences)
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+class FakeWebSocket:
+    """Stands in for a connected WebSocket; counts the frames sent to it"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_text(self, message: str):
+        self.sent += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+def register_fake_sockets(register, count: int, users: int = 1) -> list:
+    """Register count fake sockets with register (main.register_client), spread over user ids 1..users"""
+    sockets = []
+    for i in range(count):
+        websocket = FakeWebSocket()
+        register(f"user_{i % users + 1}_fake_{i}", websocket)
+        sockets.append(websocket)
+    return sockets
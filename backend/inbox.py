@@ -0,0 +1,115 @@
+"""
+Persistent notification inbox.
+
+POST /notify stores each notification before pushing it to the user's open
+sockets, so users who are offline receive it later. On connect a socket gets
+all unacknowledged notifications in one batch, read with a single query on
+the (user_id, created_at) index. Clients dedupe by id, since a notification
+sent while the socket connects can arrive both live and in the backfill.
+
+Each user keeps at most NOTIFICATION_INBOX_LIMIT notifications; the oldest
+are dropped on insert. Older than NOTIFICATION_RETENTION_DAYS are removed by
+
+    python inbox.py prune
+"""
+
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from config import get_settings
+import models
+
+def add(db: Session, user_id: int, message) -> models.Notification:
+    """Store a notification and trim the user's inbox to its limit; the caller commits"""
+    notification = models.Notification(user_id=user_id, message=message)
+    db.add(notification)
+    db.flush()
+    # Id of the newest row past the limit; it and everything older go
+    boundary = db.query(models.Notification.id).filter(
+        models.Notification.user_id == user_id
+    ).order_by(
+        models.Notification.created_at.desc(), models.Notification.id.desc()
+    ).offset(get_settings().notification_inbox_limit).limit(1).scalar()
+    if boundary is not None:
+        db.query(models.Notification).filter(
+            models.Notification.user_id == user_id,
+            models.Notification.id <= boundary
+        ).delete(synchronize_session=False)
+    return notification
+
+def notification_to_dict(notification: models.Notification) -> dict:
+    return {
+        "id": notification.id,
+        "message": notification.message,
+        "created_at": notification.created_at.isoformat(),
+        "acknowledged": notification.acknowledged_at is not None
+    }
+
+def encode_cursor(notification: models.Notification) -> str:
+    return f"{notification.created_at.isoformat()}_{notification.id}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Raises ValueError for a malformed cursor"""
+    created_at, notification_id = cursor.rsplit("_", 1)
+    return datetime.fromisoformat(created_at), int(notification_id)
+
+def list_page(db: Session, user_id: int, limit: int, before: Optional[str] = None,
+              unread_only: bool = False) -> List[models.Notification]:
+    """Newest first; before is the cursor of the last row of the previous page"""
+    query = db.query(models.Notification).filter(models.Notification.user_id == user_id)
+    if before is not None:
+        created_at, notification_id = decode_cursor(before)
+        query = query.filter(or_(
+            models.Notification.created_at < created_at,
+            and_(models.Notification.created_at == created_at, models.Notification.id < notification_id)
+        ))
+    if unread_only:
+        query = query.filter(models.Notification.acknowledged_at.is_(None))
+    return query.order_by(
+        models.Notification.created_at.desc(), models.Notification.id.desc()
+    ).limit(limit).all()
+
+def unread(db: Session, user_id: int, limit: Optional[int] = None) -> List[models.Notification]:
+    """Oldest first, for the backfill sent when a socket connects"""
+    return db.query(models.Notification).filter(
+        models.Notification.user_id == user_id,
+        models.Notification.acknowledged_at.is_(None)
+    ).order_by(
+        models.Notification.created_at, models.Notification.id
+    ).limit(limit or get_settings().notification_backfill_limit).all()
+
+def acknowledge(db: Session, user_id: int, ids: Optional[List[int]] = None) -> int:
+    """Mark the given notifications, or all of the user's, as read with one UPDATE"""
+    query = db.query(models.Notification).filter(
+        models.Notification.user_id == user_id,
+        models.Notification.acknowledged_at.is_(None)
+    )
+    if ids is not None:
+        query = query.filter(models.Notification.id.in_(ids))
+    updated = query.update({models.Notification.acknowledged_at: datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    return updated
+
+def prune(db: Session, retention_days: Optional[int] = None) -> int:
+    """Delete notifications older than the retention window, read or not"""
+    if retention_days is None:
+        retention_days = get_settings().notification_retention_days
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = db.query(models.Notification).filter(
+        models.Notification.created_at < cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+if __name__ == "__main__":
+    import sys
+    from database import SessionLocal
+    if len(sys.argv) < 2 or sys.argv[1] != "prune":
+        print("Usage: python inbox.py prune")
+        sys.exit(1)
+    db = SessionLocal()
+    try:
+        print(f"Removed {prune(db)} notification(s)")
+    finally:
+        db.close()
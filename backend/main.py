@@ -1,16 +1,64 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Body, WebSocket
+from fastapi import FastAPI, Depends, HTTPException, status, Body, WebSocket, Query, Request, Header, BackgroundTasks, Path, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-import models, schemas, auth
-from database import engine, get_db
+import models, schemas, auth, backup, broadcast, devices, inbox, passwords, snapshots, stats, tokens, tracing, usernames
+from config import get_settings
+from database import (
+    get_db, get_read_db, mark_recent_write, set_shard_key, ReadYourWritesMiddleware, SessionLocal, ReadSessionLocal
+)
+from sharding import shard_engines
+from migrate import ensure_schema
+from coalescing import UpdateCoalescer
+import changefeed
+from sse import SSEConnection
+from serialization import FastJSONResponse, dumps, user_to_dict, preferences_to_dict
+from contextlib import asynccontextmanager, nullcontext
 from datetime import timedelta
+from typing import Optional
+import asyncio
 import json
+import logging
+import random
+import uuid
+
+# MCP tools served from this process, see MCP_MOUNT_PATH
+mcp_app = None
+# Configured by uvicorn and gunicorn, so INFO messages reach the server log
+logger = logging.getLogger("uvicorn.error")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema setup runs at most once per process, on first startup
+    if get_settings().auto_migrate:
+        ensure_schema()
+
+    passwords.configure()
+
+    db = SessionLocal()
+    try:
+        auth.load_revoked_users(db)
+        usernames.refresh(db)
+    finally:
+        db.close()
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
+    # Mounted apps do not get lifespan events, so run the MCP one here
+    async with (mcp_app.lifespan(mcp_app) if mcp_app else nullcontext()):
+        yield
 
-app = FastAPI(title="User Authentication API")
+    # Workers may be stopped before the exporter's next write
+    tracing.flush()
+
+app = FastAPI(title="User Authentication API", lifespan=lifespan)
+
+# Server span per request, continuing the trace of callers such as the MCP server
+tracing.configure("preferences-api")
+app.add_middleware(tracing.TracingMiddleware)
+# Carries read-your-writes stickiness across workers in a short-lived cookie
+app.add_middleware(ReadYourWritesMiddleware)
 
 # Add CORS middleware
 app.add_middleware(
@@ -19,33 +67,57 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", snapshots.SNAPSHOT_HEADER],
 )
 
 @app.post("/auth/register", response_model=schemas.User, tags=["Authentication"], 
           summary="Register a new user")
 def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    # Check if user already exists
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
-    if db_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already registered"
-        )
-    
-    # Create new user
+    # Insert and let the unique index reject duplicates; checking first races
     hashed_password = auth.get_password_hash(user.password)
     db_user = models.User(
         username=user.username,
         hashed_password=hashed_password
     )
     db.add(db_user)
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already registered"
+        )
+
+    # Default preferences in the same unit of work, so GET /preferences never has to create them.
+    # With sharding the row goes to the user's shard, which commits as a separate transaction.
+    set_shard_key(db, db_user.id)
+    user_preferences = models.Preferences(user_id=db_user.id)
+    db.add(user_preferences)
+    db.flush()
+    changefeed.record_change(db, user_preferences)
     db.commit()
     db.refresh(db_user)
+    usernames.add(db_user.username)
+    mark_recent_write(db_user.username)
+    changefeed.notify_waiters()
     return db_user
 
+@app.get("/auth/username-available", tags=["Authentication"],
+         summary="Check whether a username is free")
+def username_available(username: str = Query(..., min_length=1), db: Session = Depends(get_read_db)):
+    """
+    Answered from an in-memory Bloom filter when the name was never registered;
+    possible matches are confirmed with an indexed lookup. Registration still
+    rejects a name taken in the meantime.
+    """
+    return {"username": username, "available": usernames.is_available(db, username)}
+
 @app.post("/auth/login", response_model=schemas.Token, tags=["Authentication"],
           summary="Login to obtain access token")
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login_for_access_token(background_tasks: BackgroundTasks, form_data: OAuth2PasswordRequestForm = Depends(),
+                           db: Session = Depends(get_db)):
+    # Sync handler: password hashing runs in the threadpool instead of blocking the event loop
     user = auth.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
@@ -53,41 +125,93 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
+    if auth.password_needs_rehash(user):
+        # Upgrade to the current scheme and cost without delaying this response
+        background_tasks.add_task(auth.rehash_password, user.id, user.hashed_password, form_data.password)
+    return issue_tokens(db, user)
+
+def issue_tokens(db: Session, user: models.User, refresh_token: str = None):
+    """
+    Create an access token, plus a refresh token unless one is given, and a
+    preferences snapshot so the client can render before fetching preferences
+    """
+    settings = get_settings()
+    access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
     access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=auth.token_claims_for(user), expires_delta=access_token_expires
     )
+    set_shard_key(db, user.id)
+    user_preferences = db.query(models.Preferences).filter(
+        models.Preferences.user_id == user.id
+    ).first()
     return {
         "access_token": access_token, 
         "token_type": "bearer",
-        "expires_in": auth.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        "expires_in": settings.access_token_expire_minutes * 60,
+        "refresh_token": refresh_token or auth.create_refresh_token(db, user),
+        "preferences_snapshot": snapshots.create(user.id, user_preferences)
     }
 
+@app.post("/auth/refresh", response_model=schemas.Token, tags=["Authentication"],
+          summary="Exchange a refresh token for a new access token")
+def refresh_access_token(request: schemas.RefreshRequest, db: Session = Depends(get_db)):
+    """
+    Rotate the refresh token and issue a new access token without a password check.
+    The presented refresh token is revoked and must not be used again.
+    """
+    rotated = auth.rotate_refresh_token(db, request.refresh_token)
+    if rotated is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user, refresh_token = rotated
+    return issue_tokens(db, user, refresh_token)
+
+@app.post("/auth/revoke", tags=["Authentication"],
+          summary="Revoke a refresh token")
+def revoke_refresh_token(request: schemas.RefreshRequest, db: Session = Depends(get_db)):
+    auth.revoke_refresh_token(db, request.refresh_token)
+    return {"status": "success", "message": "Refresh token revoked"}
+
 @app.get("/users/profile", response_model=schemas.User, tags=["Users"],
          summary="Get current user profile")
 async def get_user_profile(current_user: models.User = Depends(auth.get_current_active_user)):
-    return current_user
+    return FastJSONResponse(user_to_dict(current_user))
 
 @app.get("/auth/validate-token", tags=["Authentication"],
          summary="Validate if the current token is valid")
-async def validate_token(current_user: models.User = Depends(auth.get_current_active_user)):
-    return {
+async def validate_token(token_user: schemas.TokenData = Depends(auth.get_current_token_user)):
+    return FastJSONResponse({
         "status": "success",
         "message": "Token is valid",
         "data": {
-            "user_id": current_user.id,
-            "username": current_user.username,
-            "is_active": current_user.is_active
+            "user_id": token_user.user_id,
+            "username": token_user.username,
+            "is_active": token_user.is_active
         }
-    }
+    })
 
 @app.get("/preferences", response_model=schemas.Preferences, tags=["Preferences"],
          summary="Get user preferences")
-async def get_preferences(current_user: models.User = Depends(auth.get_current_active_user),
-                         db: Session = Depends(get_db)):
+async def get_preferences(device: Optional[str] = Query(None, pattern=devices.DEVICE_PATTERN,
+                                                        description="Return the resolved preferences of this device"),
+                         if_none_match: Optional[str] = Header(None),
+                         current_user: models.User = Depends(auth.get_current_active_user),
+                         db: Session = Depends(get_read_db)):
     """
-    Retrieve the preferences for the current logged-in user.
+    Retrieve the preferences for the current logged-in user, or the effective
+    preferences of one of their devices. The user's preferences carry their
+    version as ETag; with a matching If-None-Match the answer is 304.
     """
+    set_shard_key(db, current_user.id)
+    if device is not None:
+        # Precomputed on write, so one indexed lookup
+        device_preferences = devices.get_device(db, current_user.id, device)
+        if device_preferences is not None:
+            return FastJSONResponse(devices.device_to_dict(device_preferences))
+
     # Check if user has preferences already
     user_preferences = db.query(models.Preferences).filter(
         models.Preferences.user_id == current_user.id
@@ -97,103 +221,520 @@ async def get_preferences(current_user: models.User = Depends(auth.get_current_a
     if not user_preferences:
         user_preferences = models.Preferences(user_id=current_user.id)
         db.add(user_preferences)
-        db.commit()
-        db.refresh(user_preferences)
-        
-    return user_preferences
+        try:
+            db.flush()
+            changefeed.record_change(db, user_preferences)
+            db.commit()
+        except IntegrityError:
+            # The row exists on the primary; the replica had not caught up yet
+            db.rollback()
+            db.info["use_primary"] = True
+            user_preferences = db.query(models.Preferences).filter(
+                models.Preferences.user_id == current_user.id
+            ).one()
+        else:
+            db.refresh(user_preferences)
+            mark_recent_write(current_user.username)
+            changefeed.notify_waiters()
+
+    if snapshots.is_current(if_none_match, current_user.id, user_preferences.version):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers={"ETag": snapshots.etag(current_user.id, user_preferences.version)})
+    prefs_dict = preferences_to_dict(user_preferences)
+    return FastJSONResponse(prefs_dict, headers=snapshots.headers(prefs_dict))
+
+@app.get("/admin/preferences/stats", tags=["Admin"],
+         summary="Preference counts per theme, language and notifications")
+def get_preference_stats(current_user: models.User = Depends(auth.get_current_superuser),
+                         db: Session = Depends(get_read_db)):
+    """
+    Served from counters kept up to date on every preferences write, so the
+    cost does not grow with the number of users.
+    """
+    shard_sessions = [Session(bind=shard_engine) for shard_engine in shard_engines.values()]
+    try:
+        return stats.read([db, *shard_sessions])
+    finally:
+        for shard_session in shard_sessions:
+            shard_session.close()
+
+@app.get("/admin/metrics", tags=["Admin"], summary="In-process counters")
+def get_metrics(current_user: models.User = Depends(auth.get_current_superuser)):
+    """Counters for this worker process only"""
+    return {"token_cache": tokens.cache().stats()}
+
+@app.get("/admin/export", tags=["Admin"], summary="Stream all users and preferences as NDJSON")
+def export_users(current_user: models.User = Depends(auth.get_current_superuser)):
+    """One JSON object per line, in the format read by POST /admin/import and backup.py"""
+    def stream():
+        # Owned by the generator, since the response outlives request dependencies
+        db = ReadSessionLocal()
+        try:
+            for record in backup.export_records(db):
+                yield dumps(record) + b"\n"
+        finally:
+            db.close()
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/admin/import", tags=["Admin"], summary="Upsert users and preferences from NDJSON")
+async def import_users(request: Request, current_user: models.User = Depends(auth.get_current_superuser),
+                       db: Session = Depends(get_db)):
+    """
+    Reads the body as it arrives and commits every backup.IMPORT_BATCH_SIZE
+    users. If a line is invalid, earlier batches stay imported and the error
+    says how far the import got.
+    """
+    counts = {"created": 0, "updated": 0}
+    batch = []
+    buffer = b""
+    line_number = 0
+
+    async def flush():
+        await run_in_threadpool(backup.import_batch, db, batch[:], counts)
+        batch.clear()
+        logger.info("Import by %s: %d user(s) so far", current_user.username, counts["created"] + counts["updated"])
+
+    try:
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line_number += 1
+                record = backup.parse_line(line, line_number)
+                if record is not None:
+                    batch.append(record)
+                if len(batch) >= backup.IMPORT_BATCH_SIZE:
+                    await flush()
+        record = backup.parse_line(buffer, line_number + 1)
+        if record is not None:
+            batch.append(record)
+        if batch:
+            await flush()
+    except backup.InvalidRecord as e:
+        logger.warning("Import by %s stopped: %s", current_user.username, e)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{e}; {counts['created'] + counts['updated']} user(s) imported before it"
+        )
+    logger.info("Import by %s finished: %d created, %d updated", current_user.username, counts["created"], counts["updated"])
+    return {"status": "success", **counts}
+
+@app.get("/preferences/devices", tags=["Preferences"],
+         summary="List per-device preference overrides")
+def list_device_preferences(current_user: models.User = Depends(auth.get_current_active_user),
+                            db: Session = Depends(get_read_db)):
+    set_shard_key(db, current_user.id)
+    return FastJSONResponse([devices.device_to_dict(row) for row in devices.list_devices(db, current_user.id)])
+
+@app.post("/preferences/devices/{device}", tags=["Preferences"],
+          summary="Set preference overrides for one device")
+async def update_device_preferences(
+    overrides: schemas.DevicePreferencesUpdate,
+    device: str = Path(..., pattern=devices.DEVICE_PATTERN),
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Only the fields present in the body change; null removes an override so
+    the device follows the user's preferences again. Only sockets connected
+    with this device are notified.
+    """
+    set_shard_key(db, current_user.id)
+    user_preferences = db.query(models.Preferences).filter(
+        models.Preferences.user_id == current_user.id
+    ).first()
+    if not user_preferences:
+        user_preferences = models.Preferences(user_id=current_user.id)
+        db.add(user_preferences)
+        db.flush()
+        changefeed.record_change(db, user_preferences)
+    row = devices.apply_device_update(db, user_preferences, device, overrides.dict(exclude_unset=True))
+    db.commit()
+    db.refresh(row)
+    mark_recent_write(current_user.username)
+    view = devices.device_to_dict(row)
+    await notify_clients(current_user.id, view, only_device=device)
+    return FastJSONResponse(view)
+
+@app.delete("/preferences/devices/{device}", tags=["Preferences"],
+            summary="Remove all overrides for one device")
+async def delete_device_preferences(
+    device: str = Path(..., pattern=devices.DEVICE_PATTERN),
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    set_shard_key(db, current_user.id)
+    row = devices.get_device(db, current_user.id, device)
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No overrides for this device")
+    db.delete(row)
+    user_preferences = db.query(models.Preferences).filter(
+        models.Preferences.user_id == current_user.id
+    ).first()
+    db.commit()
+    mark_recent_write(current_user.username)
+    if user_preferences:
+        # The device falls back to the user's preferences
+        await notify_clients(current_user.id, preferences_to_dict(user_preferences), only_device=device)
+    return {"status": "success", "message": f"Overrides for {device} removed"}
+
+@app.get("/preferences/changes", tags=["Preferences"],
+         summary="Page through the preference change feed")
+async def get_preference_changes(
+    since: int = Query(0, ge=0, description="Cursor returned by the previous page"),
+    limit: int = Query(100, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=30, description="Seconds to long-poll when there are no new changes"),
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Return changes after the given cursor, oldest first. Superusers see every
+    user's changes; other users see only their own.
+    """
+    user_id = None if current_user.is_superuser else current_user.id
+    deadline = asyncio.get_running_loop().time() + wait
+    changes = changefeed.list_changes(db, since, limit, user_id)
+    while not changes:
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            break
+        # Return the connection to the pool while waiting; the next query
+        # checks one out again in a new transaction that sees new commits
+        db.close()
+        # Re-check at least every second so writes from other workers are seen
+        await changefeed.wait_for_change(min(remaining, 1.0))
+        changes = changefeed.list_changes(db, since, limit, user_id)
+
+    return FastJSONResponse({
+        "changes": [changefeed.change_to_dict(change) for change in changes],
+        "next_cursor": changes[-1].id if changes else since,
+        "has_more": len(changes) == limit
+    })
 
 # Clients connected to WebSocket
 connected_clients = {}
+# user id -> {client_id: device or None}, so a user's sockets are found without scanning every connection
+clients_by_user = {}
+# topic -> client ids subscribed to it, and each subscribed client's topics for unregistering
+clients_by_topic = {}
+client_topics = {}
+
+def _user_id_of(client_id: str) -> Optional[int]:
+    # Client ids look like user_<id>_<suffix>
+    parts = client_id.split("_", 2)
+    if len(parts) == 3 and parts[0] == "user" and parts[1].isdigit():
+        return int(parts[1])
+    return None
+
+def register_client(client_id: str, connection, device: Optional[str] = None, topics: tuple = ()):
+    connected_clients[client_id] = connection
+    user_id = _user_id_of(client_id)
+    if user_id is not None:
+        clients_by_user.setdefault(user_id, {})[client_id] = device
+    if topics:
+        client_topics[client_id] = topics
+        for topic in topics:
+            clients_by_topic.setdefault(topic, set()).add(client_id)
+
+def unregister_client(client_id: str):
+    connected_clients.pop(client_id, None)
+    user_clients = clients_by_user.get(_user_id_of(client_id))
+    if user_clients is not None:
+        user_clients.pop(client_id, None)
+        if not user_clients:
+            del clients_by_user[_user_id_of(client_id)]
+    for topic in client_topics.pop(client_id, ()):
+        subscribers = clients_by_topic.get(topic)
+        if subscribers is not None:
+            subscribers.discard(client_id)
+            if not subscribers:
+                del clients_by_topic[topic]
 
 # WebSocket endpoint for real-time updates
+def _notification_backfill(user_id: int) -> Optional[str]:
+    """The user's unacknowledged notifications as one message, or None when there are none"""
+    # Primary, so notifications stored moments ago are included
+    db = SessionLocal()
+    try:
+        pending = inbox.unread(db, user_id)
+    finally:
+        db.close()
+    if not pending:
+        return None
+    return dumps({
+        "type": "notifications_backfill",
+        "data": [inbox.notification_to_dict(notification) for notification in pending]
+    }).decode("utf-8")
+
+async def _websocket_token_user_id(token: str) -> Optional[int]:
+    db = ReadSessionLocal()
+    try:
+        return (await auth.get_current_token_user(token=token, db=db)).user_id
+    except HTTPException:
+        return None
+    finally:
+        db.close()
+
 @app.websocket("/ws/preferences/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
+async def websocket_endpoint(websocket: WebSocket, client_id: str,
+                             device: Optional[str] = Query(None, pattern=devices.DEVICE_PATTERN),
+                             token: Optional[str] = Query(None),
+                             topics: Optional[str] = Query(None, pattern=broadcast.TOPICS_PATTERN)):
+    """
+    Pass ?device= to receive that device's resolved preferences, and
+    ?topics=a,b for broadcasts to those topics. With the user's access token
+    in ?token=, unacknowledged notifications are sent in one
+    notifications_backfill message after connecting.
+    """
     await websocket.accept()
-    connected_clients[client_id] = websocket
+    register_client(client_id, websocket, device, broadcast.parse_topics(topics))
     try:
+        user_id = _user_id_of(client_id)
+        if token and user_id is not None and await _websocket_token_user_id(token) == user_id:
+            # Registered first, so nothing stored after this query is missed
+            backfill = _notification_backfill(user_id)
+            if backfill:
+                await websocket.send_text(backfill)
         while True:
             # Keep connection alive, waiting for messages
             data = await websocket.receive_text()
             # We could process incoming messages here if needed
     except Exception:
-        if client_id in connected_clients:
-            del connected_clients[client_id]
+        unregister_client(client_id)
 
-# Helper function to notify clients of preference changes
-async def notify_clients(user_id: int, preferences: dict):
-    """Notify all connected clients about preference changes"""
-    user_clients = [cid for cid, _ in connected_clients.items() if cid.startswith(f"user_{user_id}_")]
-    for client_id in user_clients:
-        websocket = connected_clients.get(client_id)
-        if websocket:
-            try:
-                await websocket.send_json({
-                    "type": "preferences_updated",
-                    "data": preferences
-                })
-            except Exception:
-                # Client disconnect handling
-                if client_id in connected_clients:
-                    del connected_clients[client_id]
+async def drain_websockets():
+    """
+    Tell every connected client to reconnect after a jittered delay, then close
+    its socket with 1012 (service restart). Called by server.py before shutdown
+    so clients do not all reconnect at the same moment.
+    """
+    settings = get_settings()
 
-# Modify the update_preferences function to notify clients
-@app.post("/preferences", response_model=schemas.Preferences, tags=["Preferences"],
-          summary="Update user preferences")
-async def update_preferences(
-    preferences: schemas.PreferencesUpdate,
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    async def drain(client_id, websocket):
+        delay = random.randint(settings.reconnect_min_ms, settings.reconnect_max_ms)
+        try:
+            await websocket.send_text(dumps({
+                "type": "reconnect",
+                "retry_after_ms": delay
+            }).decode("utf-8"))
+            await websocket.close(code=1012)
+        except Exception:
+            pass
+        unregister_client(client_id)
+
+    await asyncio.gather(*(drain(cid, ws) for cid, ws in list(connected_clients.items())))
+
+# Server-Sent Events endpoint for one-way updates
+@app.get("/sse/preferences", tags=["Preferences"],
+         summary="Stream preference updates as Server-Sent Events")
+async def stream_preferences(
+    request: Request,
+    token: Optional[str] = Query(None, description="Access token, for clients that cannot set headers"),
+    authorization: Optional[str] = Header(None),
+    last_event_id: Optional[str] = Header(None),
+    device: Optional[str] = Query(None, pattern=devices.DEVICE_PATTERN),
+    topics: Optional[str] = Query(None, pattern=broadcast.TOPICS_PATTERN),
+    db: Session = Depends(get_read_db)
 ):
     """
-    Update preferences for the current logged-in user.
+    Streams the same preferences_updated events as the WebSocket. Event ids are
+    change feed cursors, so a client reconnecting with Last-Event-ID first gets
+    the current preferences if anything changed while it was away.
+    """
+    if token is None and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if token is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    token_user = await auth.get_current_token_user(token=token, db=db)
+    settings = get_settings()
+
+    connection = SSEConnection(settings.sse_buffer_size)
+    if last_event_id and last_event_id.isdigit():
+        latest = changefeed.latest_change_after(db, token_user.user_id, int(last_event_id))
+        if latest is not None:
+            set_shard_key(db, token_user.user_id)
+            user_preferences = db.query(models.Preferences).filter(
+                models.Preferences.user_id == token_user.user_id
+            ).first()
+            if user_preferences:
+                connection.push(dumps({
+                    "type": "preferences_updated",
+                    "data": preferences_to_dict(user_preferences)
+                }).decode("utf-8"), latest)
+    # Release the DB connection before the long-lived stream starts
+    db.close()
+
+    client_id = f"user_{token_user.user_id}_sse_{uuid.uuid4().hex}"
+    register_client(client_id, connection, device, broadcast.parse_topics(topics))
+    backfill = _notification_backfill(token_user.user_id)
+    if backfill:
+        connection.push(backfill)
+    retry_ms = random.randint(settings.reconnect_min_ms, settings.reconnect_max_ms)
+
+    async def events():
+        try:
+            # Jittered reconnect delay for EventSource
+            yield f"retry: {retry_ms}\n\n"
+            while not await request.is_disconnected():
+                chunk = await connection.next_chunk(settings.sse_heartbeat_seconds)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            unregister_client(client_id)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+# Helper function to notify clients of preference changes
+async def notify_clients(user_id: int, preferences: dict, event_id: Optional[int] = None,
+                         device_views: Optional[dict] = None, only_device: Optional[str] = None,
+                         message_type: str = "preferences_updated"):
+    """
+    Notify the user's connected clients about preference changes, or send
+    another payload with message_type.
+    event_id is the change feed cursor, used by SSE clients to resume.
+    Sockets on a device listed in device_views get that device's view instead,
+    or nothing when its view is None (unchanged). With only_device, just that
+    device's sockets are notified.
+    """
+    user_clients = clients_by_user.get(user_id)
+    if not user_clients:
+        return
+    device_views = device_views or {}
+    # Encode each distinct payload once and send the same text frame to every socket
+    encoded = {}
+
+    def message_for(payload: dict) -> str:
+        if id(payload) not in encoded:
+            encoded[id(payload)] = dumps({
+                "type": message_type,
+                "data": payload
+            }).decode("utf-8")
+        return encoded[id(payload)]
+
+    with tracing.start_span("notify_clients", attributes={"user.id": user_id, "clients": len(user_clients)}) as span:
+        delivered = 0
+        for client_id, device in list(user_clients.items()):
+            if only_device is not None and device != only_device:
+                continue
+            payload = device_views[device] if device in device_views else preferences
+            if payload is None:
+                continue
+            websocket = connected_clients.get(client_id)
+            if websocket:
+                try:
+                    if isinstance(websocket, SSEConnection):
+                        websocket.push(message_for(payload), event_id)
+                    else:
+                        await websocket.send_text(message_for(payload))
+                    delivered += 1
+                except Exception:
+                    # Client disconnect handling
+                    unregister_client(client_id)
+        if span is not None:
+            span.set_attribute("delivered", delivered)
+
+def apply_preferences_update(db: Session, user_id: int, changes: dict):
+    """
+    Write changes to the user's preferences row and re-resolve their devices.
+    Returns the row as a dict, the change feed cursor of the write and the
+    per-device views for notify_clients.
     """
     # Get current preferences
+    set_shard_key(db, user_id)
     user_preferences = db.query(models.Preferences).filter(
-        models.Preferences.user_id == current_user.id
+        models.Preferences.user_id == user_id
     ).first()
     
     # If no preferences exist yet, create them
     if not user_preferences:
-        user_preferences = models.Preferences(user_id=current_user.id)
+        user_preferences = models.Preferences(user_id=user_id)
         db.add(user_preferences)
     
     # Update preferences with new values
-    for key, value in preferences.dict().items():
+    for key, value in changes.items():
         if value is not None:  # Only update non-None values
             setattr(user_preferences, key, value)
     
+    # Devices inheriting a changed field are updated in the same transaction
+    device_views = devices.refresh_devices(db, user_preferences)
+
+    # Log the change in the same transaction
+    db.flush()
+    change = changefeed.record_change(db, user_preferences)
     db.commit()
     db.refresh(user_preferences)
+    changefeed.notify_waiters()
     
-    # Notify connected clients about the changes
     # Convert to dict for JSON serialization
-    prefs_dict = {
-        "id": user_preferences.id,
-        "user_id": user_preferences.user_id,
-        "theme": user_preferences.theme,
-        "language": user_preferences.language,
-        "notifications": user_preferences.notifications
-    }
-    
-    # This runs in the background without blocking the response
+    return preferences_to_dict(user_preferences), change.id, device_views
+
+async def _broadcast_preferences(user_id: int, prefs_dict: dict, event_id: int, device_views: dict):
     try:
-        await notify_clients(current_user.id, prefs_dict)
+        await notify_clients(user_id, prefs_dict, event_id, device_views=device_views)
     except Exception as e:
         # Log the error but don't fail the request
         print(f"Error notifying clients: {str(e)}")
+
+async def _flush_coalesced_preferences(user_id: int, changes: dict) -> dict:
+    """Apply a merged burst of updates with one commit and one broadcast"""
+    db = SessionLocal()
+    try:
+        prefs_dict, event_id, device_views = apply_preferences_update(db, user_id, changes)
+    finally:
+        db.close()
+    await _broadcast_preferences(user_id, prefs_dict, event_id, device_views)
+    return prefs_dict
+
+# Merges bursts of updates from the same user when PREFERENCES_COALESCE_MS > 0
+preferences_coalescer = UpdateCoalescer(
+    get_settings().preferences_coalesce_ms / 1000, _flush_coalesced_preferences
+)
+
+# Modify the update_preferences function to notify clients
+@app.post("/preferences", response_model=schemas.Preferences, tags=["Preferences"],
+          summary="Update user preferences")
+async def update_preferences(
+    preferences: schemas.PreferencesUpdate,
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Update preferences for the current logged-in user.
+    Only the fields present in the request body are changed.
+    """
+    changes = preferences.dict(exclude_unset=True)
+
+    if preferences_coalescer.enabled:
+        # Each caller in the window gets the merged row
+        prefs_dict = await preferences_coalescer.submit(current_user.id, changes)
+    else:
+        prefs_dict, event_id, device_views = apply_preferences_update(db, current_user.id, changes)
+        # Notify connected clients about the changes
+        await _broadcast_preferences(current_user.id, prefs_dict, event_id, device_views)
+    mark_recent_write(current_user.username)
         
-    return user_preferences
+    return FastJSONResponse(prefs_dict, headers=snapshots.headers(prefs_dict))
 
 # Add notification endpoint
 @app.post("/notify", tags=["Notifications"],
           summary="Send notification to connected clients")
 async def send_notification(
     notification: dict = Body(...),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: Session = Depends(get_db)
 ):
     """
-    Send a notification to all connected clients for a specific user.
-    Requires user_id and message in the request body.
+    Store a notification in the user's inbox and send it to their connected
+    clients as a "notification" message. Requires user_id and message in the
+    request body.
     """
     user_id = notification.get("user_id")
     message = notification.get("message")
@@ -211,11 +752,80 @@ async def send_notification(
             detail="Not authorized to send notifications to this user"
         )
         
+    stored = inbox.add(db, user_id, message)
+    db.commit()
     try:
-        await notify_clients(user_id, message)
-        return {"status": "success", "message": "Notification sent"}
+        await notify_clients(user_id, inbox.notification_to_dict(stored), message_type="notification")
+        return {"status": "success", "message": "Notification sent", "id": stored.id}
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to send notification: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@app.get("/notifications", tags=["Notifications"], summary="Page through the user's notifications")
+def list_notifications(
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(50, ge=1, le=200),
+    unread: bool = Query(False, description="Only notifications not yet acknowledged"),
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Newest first. Each page is one range scan of the (user_id, created_at) index."""
+    # Primary: notifications are usually written by other users, outside this user's read-your-writes window
+    try:
+        notifications = inbox.list_page(db, current_user.id, limit, cursor, unread)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return FastJSONResponse({
+        "notifications": [inbox.notification_to_dict(notification) for notification in notifications],
+        "next_cursor": inbox.encode_cursor(notifications[-1]) if len(notifications) == limit else None
+    })
+
+@app.post("/notifications/ack", tags=["Notifications"], summary="Mark notifications as read")
+def acknowledge_notifications(
+    ack: Optional[schemas.NotificationAck] = None,
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Acknowledged notifications are no longer sent when a socket connects"""
+    return {"acknowledged": inbox.acknowledge(db, current_user.id, ack.ids if ack else None)}
+
+async def broadcast_to_clients(client_ids, data: dict) -> dict:
+    """Send data as one "broadcast" message, encoded once, to the given clients"""
+    message = dumps({"type": "broadcast", "data": data}).decode("utf-8")
+    targets = [
+        (client_id, connected_clients[client_id]) for client_id in client_ids if client_id in connected_clients
+    ]
+    return await broadcast.send_all(targets, message, unregister_client)
+
+@app.post("/admin/broadcast", tags=["Admin"], summary="Send a message to a topic, a group of users or everyone")
+async def broadcast_message(request: schemas.BroadcastRequest,
+                            current_user: models.User = Depends(auth.get_current_superuser)):
+    """
+    Live delivery to the sockets connected to this worker; broadcasts are not
+    stored in the notification inbox. Reports how many sockets were targeted,
+    delivered to and dropped, and how long it took.
+    """
+    if (request.topic is not None) + (request.user_ids is not None) + request.everyone != 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Set exactly one of topic, user_ids or everyone"
+        )
+    if request.topic is not None:
+        client_ids = list(clients_by_topic.get(request.topic, ()))
+    elif request.user_ids is not None:
+        client_ids = [
+            client_id for user_id in set(request.user_ids) for client_id in clients_by_user.get(user_id, ())
+        ]
+    else:
+        client_ids = list(connected_clients)
+    return await broadcast_to_clients(client_ids, {"topic": request.topic, "message": request.message})
+
+# Serve the MCP tools from the API process; their API calls then stay in-process
+if get_settings().mcp_mount_path:
+    import mcp_sessions
+    from mcp_server import mcp
+    mcp_app = mcp.http_app(path="/")
+    app.mount(get_settings().mcp_mount_path, mcp_app)
+    mcp_sessions.use_in_process_app(app)
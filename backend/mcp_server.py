@@ -4,28 +4,26 @@ This MCP server provides tools for Claude to interact with the preferences API.
 """
 
 from fastmcp import FastMCP, Context
-import httpx
-import os
 import json
 import asyncio
 from typing import Optional, Literal, Dict, Any
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from config import get_settings
+from mcp_sessions import Credentials, api_client, api_request, session_key, sessions
+import resilience
+import tracing
+from resilience import timed
 
 # Load environment variables
 load_dotenv()
+tracing.configure("preferences-mcp")
 
 # Create an MCP server
 mcp = FastMCP("Preferences Assistant")
 
-# API settings
-API_URL = os.getenv("API_URL", "http://localhost:8000")
-HEADERS = {"Content-Type": "application/json"}
-
-# Auth token storage (Note: In production, use a more secure method)
-# This is a simple way to maintain token between calls in the same session
-AUTH_TOKEN = None
-USER_ID = None
+# Credentials are stored per MCP session, so one process serves many users
+# (Note: tokens are held in memory only and are lost on restart)
 
 class PreferencesUpdate(BaseModel):
     """Model for updating user preferences"""
@@ -34,12 +32,12 @@ class PreferencesUpdate(BaseModel):
     notifications: Optional[bool] = None
 
 # Helper function to notify frontend via WebSocket
-async def notify_frontend(action: str, data: Dict[str, Any] = None):
+async def notify_frontend(credentials: Credentials, action: str, data: Dict[str, Any] = None):
     """Send notification to frontend through the WebSocket connection"""
-    if USER_ID is None:
+    if credentials.user_id is None:
         return
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Format message for frontend
             message = {
@@ -48,53 +46,44 @@ async def notify_frontend(action: str, data: Dict[str, Any] = None):
                 "source": "claude-desktop"
             }
             
-            # Send to WebSocket endpoint
-            client_id = f"claude_bot_{USER_ID}"
-            ws_url = f"ws://{API_URL.replace('http://', '')}/ws/preferences/{client_id}"
-            
             # Since httpx doesn't support WebSockets directly, use it to call the API
             # This API call will forward the message to all connected clients
-            response = await client.post(
-                f"{API_URL}/notify",
-                json={"user_id": USER_ID, "message": message},
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "POST", "/notify", json={"user_id": credentials.user_id, "message": message})
             return response.status_code == 200
         except Exception as e:
             print(f"Failed to notify frontend: {str(e)}")
             return False
 
 @mcp.tool()
-async def login(username: str, password: str) -> dict:
+@timed
+async def login(username: str, password: str, ctx: Context = None) -> dict:
     """
     Login to the preferences system with username and password.
     Returns authentication status and message.
     """
-    global AUTH_TOKEN, USER_ID
+    credentials = sessions.get(session_key(ctx))
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Call the login API endpoint
-            response = await client.post(
-                f"{API_URL}/auth/login",
+            response = await resilience.request(
+                client, "POST", f"{get_settings().api_url}/auth/login", idempotent=False,
                 data={"username": username, "password": password}
             )
             
             if response.status_code == 200:
                 data = response.json()
-                AUTH_TOKEN = data["access_token"]
+                credentials.access_token = data["access_token"]
+                credentials.refresh_token = data.get("refresh_token")
                 
                 # Get user ID from token validation
-                user_response = await client.get(
-                    f"{API_URL}/auth/validate-token",
-                    headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-                )
+                user_response = await api_request(client, credentials, "GET", "/auth/validate-token")
                 if user_response.status_code == 200:
                     user_data = user_response.json()
-                    USER_ID = user_data.get("data", {}).get("user_id")
+                    credentials.user_id = user_data.get("data", {}).get("user_id")
                     
                     # Notify frontend about login
-                    await notify_frontend("login-success")
+                    await notify_frontend(credentials, "login-success")
                 
                 return {
                     "status": "success",
@@ -112,12 +101,14 @@ async def login(username: str, password: str) -> dict:
             }
 
 @mcp.tool()
+@timed
 async def get_preferences(ctx: Context = None) -> dict:
     """
     Get the current user preferences.
     User must be logged in first.
     """
-    if not AUTH_TOKEN:
+    credentials = sessions.get(session_key(ctx))
+    if not credentials.access_token:
         return {
             "status": "error",
             "message": "You need to login first. Please use the login tool."
@@ -126,13 +117,10 @@ async def get_preferences(ctx: Context = None) -> dict:
     if ctx:
         await ctx.info("Fetching user preferences...")
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Call the preferences API endpoint with auth token
-            response = await client.get(
-                f"{API_URL}/preferences",
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "GET", "/preferences")
             
             if response.status_code == 200:
                 preferences = response.json()
@@ -161,12 +149,14 @@ async def get_preferences(ctx: Context = None) -> dict:
             }
 
 @mcp.tool()
+@timed
 async def update_theme(theme: Literal["light", "dark", "system"], ctx: Context = None) -> dict:
     """
     Update the user's theme preference.
     User must be logged in first.
     """
-    if not AUTH_TOKEN:
+    credentials = sessions.get(session_key(ctx))
+    if not credentials.access_token:
         return {
             "status": "error",
             "message": "You need to login first. Please use the login tool."
@@ -175,19 +165,15 @@ async def update_theme(theme: Literal["light", "dark", "system"], ctx: Context =
     if ctx:
         await ctx.info(f"Updating theme to {theme}...")
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Call the preferences API endpoint with auth token
-            response = await client.post(
-                f"{API_URL}/preferences",
-                json={"theme": theme},
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "POST", "/preferences", json={"theme": theme})
             
             if response.status_code == 200:
                 # Notify frontend about theme change
                 preferences_data = response.json()
-                await notify_frontend("preferences-updated", preferences_data)
+                await notify_frontend(credentials, "preferences-updated", preferences_data)
                 
                 return {
                     "status": "success",
@@ -209,13 +195,15 @@ async def update_theme(theme: Literal["light", "dark", "system"], ctx: Context =
             }
 
 @mcp.tool()
+@timed
 async def update_language(language: str, ctx: Context = None) -> dict:
     """
     Update the user's language preference.
     Common languages: english, spanish, french, german, etc.
     User must be logged in first.
     """
-    if not AUTH_TOKEN:
+    credentials = sessions.get(session_key(ctx))
+    if not credentials.access_token:
         return {
             "status": "error",
             "message": "You need to login first. Please use the login tool."
@@ -224,19 +212,15 @@ async def update_language(language: str, ctx: Context = None) -> dict:
     if ctx:
         await ctx.info(f"Updating language to {language}...")
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Call the preferences API endpoint with auth token
-            response = await client.post(
-                f"{API_URL}/preferences",
-                json={"language": language.lower()},
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "POST", "/preferences", json={"language": language.lower()})
             
             if response.status_code == 200:
                 # Notify frontend about language change
                 preferences_data = response.json()
-                await notify_frontend("preferences-updated", preferences_data)
+                await notify_frontend(credentials, "preferences-updated", preferences_data)
                 
                 return {
                     "status": "success",
@@ -258,12 +242,14 @@ async def update_language(language: str, ctx: Context = None) -> dict:
             }
 
 @mcp.tool()
+@timed
 async def toggle_notifications(enabled: bool, ctx: Context = None) -> dict:
     """
     Enable or disable notifications.
     User must be logged in first.
     """
-    if not AUTH_TOKEN:
+    credentials = sessions.get(session_key(ctx))
+    if not credentials.access_token:
         return {
             "status": "error",
             "message": "You need to login first. Please use the login tool."
@@ -272,20 +258,16 @@ async def toggle_notifications(enabled: bool, ctx: Context = None) -> dict:
     if ctx:
         await ctx.info(f"{'Enabling' if enabled else 'Disabling'} notifications...")
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Call the preferences API endpoint with auth token
-            response = await client.post(
-                f"{API_URL}/preferences",
-                json={"notifications": enabled},
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "POST", "/preferences", json={"notifications": enabled})
             
             if response.status_code == 200:
                 status = "enabled" if enabled else "disabled"
                 # Notify frontend about notifications change
                 preferences_data = response.json()
-                await notify_frontend("preferences-updated", preferences_data)
+                await notify_frontend(credentials, "preferences-updated", preferences_data)
                 
                 return {
                     "status": "success",
@@ -307,6 +289,7 @@ async def toggle_notifications(enabled: bool, ctx: Context = None) -> dict:
             }
 
 @mcp.tool()
+@timed
 async def update_all_preferences(
     theme: Optional[Literal["light", "dark", "system"]] = None,
     language: Optional[str] = None,
@@ -318,7 +301,8 @@ async def update_all_preferences(
     Set any preference to None to keep its current value.
     User must be logged in first.
     """
-    if not AUTH_TOKEN:
+    credentials = sessions.get(session_key(ctx))
+    if not credentials.access_token:
         return {
             "status": "error",
             "message": "You need to login first. Please use the login tool."
@@ -342,14 +326,10 @@ async def update_all_preferences(
             "message": "No preferences specified to update."
         }
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
             # Call the preferences API endpoint with auth token
-            response = await client.post(
-                f"{API_URL}/preferences",
-                json=update_data,
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "POST", "/preferences", json=update_data)
             
             if response.status_code == 200:
                 # Build response message
@@ -365,7 +345,7 @@ async def update_all_preferences(
                 
                 # Notify frontend about multiple preferences update
                 preferences_data = response.json()
-                await notify_frontend("preferences-updated", preferences_data)
+                await notify_frontend(credentials, "preferences-updated", preferences_data)
                 
                 return {
                     "status": "success",
@@ -388,22 +368,21 @@ async def update_all_preferences(
             }
 
 @mcp.tool()
-async def validate_token() -> dict:
+@timed
+async def validate_token(ctx: Context = None) -> dict:
     """
     Check if the current auth token is valid.
     """
-    if not AUTH_TOKEN:
+    credentials = sessions.get(session_key(ctx))
+    if not credentials.access_token:
         return {
             "status": "error",
             "message": "No authentication token available. Please login first."
         }
     
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         try:
-            response = await client.get(
-                f"{API_URL}/auth/validate-token",
-                headers={**HEADERS, "Authorization": f"Bearer {AUTH_TOKEN}"}
-            )
+            response = await api_request(client, credentials, "GET", "/auth/validate-token")
             
             if response.status_code == 200:
                 return {
@@ -422,6 +401,11 @@ async def validate_token() -> dict:
                 "message": f"An error occurred: {str(e)}"
             }
 
+@mcp.resource("metrics://api-client")
+def api_client_metrics() -> dict:
+    """Tool-call latency, API call counters and circuit breaker state"""
+    return resilience.snapshot()
+
 @mcp.prompt()
 def help_prompt() -> str:
     """Provides help information about the preferences system"""
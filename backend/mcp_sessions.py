@@ -0,0 +1,178 @@
+"""
+Per-session credentials for the MCP servers.
+One MCP process can serve many assistant sessions; each session keeps its own
+tokens in a bounded store whose entries expire after a period of inactivity.
+All sessions share one pooled HTTP client, and api_request refreshes a
+session's expired access token with its refresh token.
+
+With MCP_API_TRANSPORT=asgi, or when the MCP server is mounted into the API
+(MCP_MOUNT_PATH), that client calls the FastAPI app in-process through an
+ASGI transport instead of making loopback HTTP requests.
+"""
+
+import asyncio
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+from fastmcp.exceptions import ToolError
+import httpx
+import resilience
+from config import get_settings
+
+HEADERS = {"Content-Type": "application/json"}
+
+@dataclass
+class Credentials:
+    access_token: Optional[str] = None
+    refresh_token: Optional[str] = None
+    user_id: Optional[int] = None
+    last_used: float = 0.0
+    # Serializes token refreshes, so concurrent calls do not reuse a rotated refresh token
+    refresh_lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False, compare=False)
+
+class SessionStore:
+    """LRU of credentials keyed by MCP session, bounded in size and idle time"""
+
+    def __init__(self, max_sessions: Optional[int] = None, ttl_seconds: Optional[int] = None):
+        # Unset limits come from MCP_MAX_SESSIONS and MCP_SESSION_TTL_SECONDS
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Credentials]" = OrderedDict()
+
+    def get(self, key: str) -> Credentials:
+        """Credentials for the session, empty if it never logged in or expired"""
+        settings = get_settings()
+        max_sessions = self.max_sessions or settings.mcp_max_sessions
+        ttl_seconds = self.ttl_seconds or settings.mcp_session_ttl_seconds
+        now = time.monotonic()
+        credentials = self._sessions.get(key)
+        if credentials is None or now - credentials.last_used > ttl_seconds:
+            credentials = Credentials()
+            self._sessions[key] = credentials
+        credentials.last_used = now
+        self._sessions.move_to_end(key)
+        while len(self._sessions) > max_sessions:
+            self._sessions.popitem(last=False)
+        return credentials
+
+    def clear(self, key: str):
+        self._sessions.pop(key, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+sessions = SessionStore()
+
+# Keys for connections without an MCP session id (stdio, in-memory), per
+# session object; a random key is never reused by a later session
+_session_keys: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+def session_key(ctx) -> str:
+    """
+    Key for the calling session: the MCP session id on HTTP transports,
+    otherwise a key assigned to the connection's session object on first use.
+    Raises ToolError when the call cannot be tied to a session, rather than
+    letting it share credentials with other callers.
+    """
+    if ctx is None:
+        raise ToolError("This tool must be called within an MCP session")
+    session_id = ctx.session_id
+    if session_id:
+        return session_id
+    try:
+        session = ctx.session
+    except (RuntimeError, ValueError):
+        raise ToolError("This tool must be called within an MCP session")
+    key = _session_keys.get(session)
+    if key is None:
+        key = _session_keys[session] = f"session-{uuid.uuid4().hex}"
+    return key
+
+_client: Optional[httpx.AsyncClient] = None
+# Created on first use, inside the running loop
+_client_lock: Optional[asyncio.Lock] = None
+# API app to call in-process, set when the MCP server is mounted into it
+_in_process_app = None
+# Lifespan of an API app started by this module; held open for the process
+_app_lifespan = None
+
+def use_in_process_app(app):
+    """Route API calls to an app that is already running in this process"""
+    global _in_process_app, _client
+    _in_process_app = app
+    _client = None
+
+async def _create_client() -> httpx.AsyncClient:
+    global _app_lifespan
+    app = _in_process_app
+    if app is None and get_settings().mcp_api_transport == "asgi":
+        # Nothing else runs the API here, so start its lifespan (schema check, revocation set)
+        from main import app
+        _app_lifespan = app.router.lifespan_context(app)
+        await _app_lifespan.__aenter__()
+    if app is not None:
+        # Same routes, auth and notifications, without sockets or HTTP parsing
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url=get_settings().api_url)
+    return httpx.AsyncClient(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+
+@asynccontextmanager
+async def api_client():
+    """Shared AsyncClient; kept open so connections are reused across tool calls"""
+    global _client, _client_lock
+    if _client is None or _client.is_closed:
+        if _client_lock is None:
+            _client_lock = asyncio.Lock()
+        # Concurrent first calls must not each start the app's lifespan or open a client
+        async with _client_lock:
+            if _client is None or _client.is_closed:
+                _client = await _create_client()
+    yield _client
+
+async def refresh_access_token(client: httpx.AsyncClient, credentials: Credentials, expired_token: Optional[str]) -> bool:
+    """
+    Exchange the session's refresh token for a new token pair, once per expired
+    access token: calls that waited for another call's refresh reuse its result.
+    """
+    async with credentials.refresh_lock:
+        if credentials.access_token != expired_token:
+            return credentials.access_token is not None
+        if not credentials.refresh_token:
+            return False
+        response = await resilience.request(
+            client, "POST", f"{get_settings().api_url}/auth/refresh", idempotent=False,
+            json={"refresh_token": credentials.refresh_token},
+            headers=HEADERS
+        )
+        if response.status_code != 200:
+            credentials.refresh_token = None
+            return False
+        data = response.json()
+        credentials.access_token = data["access_token"]
+        credentials.refresh_token = data.get("refresh_token")
+        return True
+
+async def api_request(client: httpx.AsyncClient, credentials: Credentials, method: str, path: str, **kwargs) -> httpx.Response:
+    """
+    Call the API with the session's token, refreshing it once if it has expired.
+    GET calls are idempotent and retried on transient failures; all calls share
+    the time budget and circuit breaker in resilience.py.
+    """
+    idempotent = method == "GET"
+    url = f"{get_settings().api_url}{path}"
+    access_token = credentials.access_token
+    response = await resilience.request(
+        client, method, url, idempotent,
+        headers={**HEADERS, "Authorization": f"Bearer {access_token}"},
+        **kwargs
+    )
+    if response.status_code == 401 and await refresh_access_token(client, credentials, access_token):
+        response = await resilience.request(
+            client, method, url, idempotent,
+            headers={**HEADERS, "Authorization": f"Bearer {credentials.access_token}"},
+            **kwargs
+        )
+    return response
@@ -0,0 +1,57 @@
+"""
+Create the database schema.
+Run `python migrate.py` once per deployment and start the API with
+AUTO_MIGRATE=false so workers never touch the schema on startup.
+"""
+
+import sys
+from sqlalchemy import inspect, text
+import models
+import stats
+from database import engine, replica_engine
+from sharding import create_shard_schemas
+
+# Set once the schema has been checked in this process
+_schema_checked = False
+
+def run_migrations(bind=engine, metadata=models.Base.metadata):
+    """Create any missing tables of metadata and add columns that existing tables lack"""
+    had_stats = inspect(bind).has_table(models.PreferenceStat.__tablename__)
+    metadata.create_all(bind=bind)
+    _add_missing_columns(bind, metadata)
+    if not had_stats:
+        # Seed the counters from rows that predate them
+        stats.rebuild(bind)
+
+def _add_missing_columns(bind, metadata):
+    # create_all skips existing tables, so columns added to a model later
+    # (such as users.is_superuser) are added here
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                default = ""
+                if column.default is not None and column.default.is_scalar:
+                    value = column.default.arg
+                    default = f" DEFAULT {str(value).upper() if isinstance(value, bool) else repr(value)}"
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}"))
+
+def ensure_schema():
+    """Run the migrations at most once per process"""
+    global _schema_checked
+    if not _schema_checked:
+        run_migrations()
+        create_shard_schemas()
+        _schema_checked = True
+
+if __name__ == "__main__":
+    run_migrations()
+    create_shard_schemas()
+    # For local testing with two SQLite files; real replicas get the schema through replication
+    if "--replica" in sys.argv and replica_engine is not None:
+        run_migrations(bind=replica_engine)
+    print("Database schema is up to date.")
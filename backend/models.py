@@ -1,5 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, JSON
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, JSON, DateTime, UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship
+from datetime import datetime
 from database import Base
 
 class User(Base):
@@ -9,9 +10,11 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     is_active = Column(Boolean, default=True)
+    is_superuser = Column(Boolean, default=False)
     
     # Relationship with preferences
     preferences = relationship("Preferences", back_populates="user", uselist=False, cascade="all, delete-orphan")
+    refresh_tokens = relationship("RefreshToken", back_populates="user", cascade="all, delete-orphan")
 
 class Preferences(Base):
     __tablename__ = "preferences"
@@ -21,6 +24,74 @@ class Preferences(Base):
     theme = Column(String, default="light")
     language = Column(String, default="english")
     notifications = Column(Boolean, default=True)
+    # Incremented by the database on every UPDATE of the row; clients compare it
+    # with the version of their preferences snapshot
+    version = Column(Integer, default=1, onupdate=text("version + 1"))
     
     # Relationship with user
-    user = relationship("User", back_populates="preferences")
\ No newline at end of file
+    user = relationship("User", back_populates="preferences")
+
+class DevicePreferences(Base):
+    """
+    Per-device overrides layered over a user's preferences. A null override
+    inherits the user's value; resolved_* hold the effective values, updated
+    on every write to either row so reads need no merge.
+    """
+    __tablename__ = "device_preferences"
+    __table_args__ = (UniqueConstraint("user_id", "device"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, index=True)
+    device = Column(String)
+    theme = Column(String, nullable=True)
+    language = Column(String, nullable=True)
+    notifications = Column(Boolean, nullable=True)
+    resolved_theme = Column(String)
+    resolved_language = Column(String)
+    resolved_notifications = Column(Boolean)
+
+class PreferenceChange(Base):
+    """Append-only log of preference changes; the id is the feed cursor"""
+    __tablename__ = "preference_changes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, index=True)
+    # Full snapshot of the row after the change
+    theme = Column(String)
+    language = Column(String)
+    notifications = Column(Boolean)
+    changed_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    # Only a SHA-256 digest of the token is stored, never the token itself
+    token_hash = Column(String, unique=True, index=True)
+    expires_at = Column(DateTime)
+    revoked = Column(Boolean, default=False)
+
+    # Relationship with user
+    user = relationship("User", back_populates="refresh_tokens")
+
+class PreferenceStat(Base):
+    """Number of preferences rows per value of each field, kept current by stats.py"""
+    __tablename__ = "preference_stats"
+
+    # Field name (theme, language, notifications) and the value as a string
+    dimension = Column(String, primary_key=True)
+    value = Column(String, primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+
+class Notification(Base):
+    """A user's notification inbox, kept until acknowledged and pruned by inbox.py"""
+    __tablename__ = "notifications"
+    # Every read is one user's newest or oldest unacknowledged rows
+    __table_args__ = (Index("ix_notifications_user_created", "user_id", "created_at"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    message = Column(JSON)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    acknowledged_at = Column(DateTime, nullable=True)
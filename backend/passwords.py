@@ -0,0 +1,124 @@
+"""
+Password hashing.
+
+PASSWORD_SCHEME picks bcrypt (default) or argon2 (needs argon2-cffi). Hashes
+from the other scheme still verify and are replaced on the next login. The
+cost (bcrypt rounds, argon2 time cost) comes from PASSWORD_HASH_ROUNDS, or is
+calibrated at startup so one hash takes about PASSWORD_HASH_TARGET_MS on this
+machine. Hashes below the chosen cost are flagged by needs_update.
+
+Compare settings on this hardware with:
+
+    python passwords.py benchmark
+"""
+
+import sys
+import time
+from passlib.context import CryptContext
+from config import get_settings
+
+try:
+    # passlib's argon2 backend
+    import argon2  # noqa: F401
+    HAVE_ARGON2 = True
+except ImportError:
+    HAVE_ARGON2 = False
+
+SCHEMES = ("bcrypt", "argon2")
+# Never calibrate below these, however slow the machine
+MIN_ROUNDS = {"bcrypt": 10, "argon2": 2}
+MAX_ROUNDS = {"bcrypt": 16, "argon2": 20}
+
+def _build_context(scheme: str, rounds: int) -> CryptContext:
+    settings = get_settings()
+    options = {
+        # Existing hashes below the chosen cost are upgraded on login; higher ones are left alone
+        f"{scheme}__default_rounds": rounds,
+        f"{scheme}__min_rounds": rounds,
+    }
+    if scheme == "argon2":
+        options["argon2__memory_cost"] = settings.argon2_memory_kib
+        # One lane per hash; concurrent logins already keep every core busy
+        options["argon2__parallelism"] = 1
+    # The first scheme hashes new passwords; "auto" deprecates the rest
+    schemes = [scheme] + [other for other in SCHEMES if other != scheme]
+    if not HAVE_ARGON2 and scheme != "argon2":
+        schemes.remove("argon2")
+    return CryptContext(schemes=schemes, deprecated="auto", **options)
+
+def _time_hash(scheme: str, rounds: int) -> float:
+    """Milliseconds for one hash at this cost"""
+    context = _build_context(scheme, rounds)
+    started = time.perf_counter()
+    context.hash("calibration-password")
+    return (time.perf_counter() - started) * 1000
+
+def calibrate(scheme: str, target_ms: float) -> int:
+    """Highest cost whose hash time stays within target_ms"""
+    rounds = MIN_ROUNDS[scheme]
+    elapsed = _time_hash(scheme, rounds)
+    while rounds < MAX_ROUNDS[scheme]:
+        # bcrypt doubles per round; argon2 grows linearly with time cost
+        next_ms = elapsed * 2 if scheme == "bcrypt" else elapsed * (rounds + 1) / rounds
+        if next_ms > target_ms:
+            break
+        rounds += 1
+        elapsed = next_ms
+    return rounds
+
+pwd_context = None
+
+def configure():
+    """Build the hashing context once per process; server.py runs it before forking"""
+    global pwd_context
+    if pwd_context is not None:
+        return pwd_context
+    settings = get_settings()
+    scheme = settings.password_scheme
+    if scheme not in SCHEMES:
+        raise RuntimeError(f"PASSWORD_SCHEME must be one of {', '.join(SCHEMES)}")
+    if scheme == "argon2" and not HAVE_ARGON2:
+        raise RuntimeError("PASSWORD_SCHEME=argon2 requires argon2-cffi")
+    rounds = settings.password_hash_rounds or calibrate(scheme, settings.password_hash_target_ms)
+    pwd_context = _build_context(scheme, rounds)
+    print(f"Password hashing: {scheme} with cost {rounds}")
+    return pwd_context
+
+def verify(password: str, hashed: str) -> bool:
+    return configure().verify(password, hashed)
+
+def hash_password(password: str) -> str:
+    return configure().hash(password)
+
+def needs_update(hashed: str) -> bool:
+    return configure().needs_update(hashed)
+
+def benchmark(seconds: float = 2.0):
+    """Print single-core verify throughput for each scheme and cost"""
+    settings = get_settings()
+    for scheme in SCHEMES:
+        for rounds in range(MIN_ROUNDS[scheme], MIN_ROUNDS[scheme] + 4):
+            if scheme == "argon2" and not HAVE_ARGON2:
+                print("argon2: not installed (pip install argon2-cffi)")
+                break
+            context = _build_context(scheme, rounds)
+            hashed = context.hash("benchmark-password")
+            verified = 0
+            started = time.perf_counter()
+            while time.perf_counter() - started < seconds:
+                context.verify("benchmark-password", hashed)
+                verified += 1
+            elapsed = time.perf_counter() - started
+            memory = f", {settings.argon2_memory_kib} KiB" if scheme == "argon2" else ""
+            print(f"{scheme:7} cost {rounds:2}{memory}: {elapsed / verified * 1000:7.1f} ms/login, "
+                  f"{verified / elapsed:7.1f} logins/s/core")
+    if not settings.password_hash_rounds:
+        scheme = settings.password_scheme
+        print(f"Calibrated {scheme} cost for {settings.password_hash_target_ms:g} ms: "
+              f"{calibrate(scheme, settings.password_hash_target_ms)}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "benchmark":
+        print("Usage: python passwords.py benchmark")
+        sys.exit(1)
+    benchmark()
@@ -0,0 +1,159 @@
+"""
+Timeouts, retries and a circuit breaker for the MCP server's calls to the API.
+
+Every call gets a total time budget. Idempotent calls are retried with
+jittered exponential backoff on transport errors and 5xx responses. After
+repeated failures the breaker opens and calls fail fast until a trial call
+succeeds. Counters are kept in `metrics` for the MCP metrics resource.
+"""
+
+import asyncio
+import random
+import time
+from collections import defaultdict
+from functools import wraps
+from typing import Optional
+import httpx
+import tracing
+from config import get_settings
+
+BACKOFF_BASE_SECONDS = 0.1
+BACKOFF_MAX_SECONDS = 1.0
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the breaker is open"""
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: Optional[int] = None, reset_seconds: Optional[float] = None):
+        # Unset values come from MCP_BREAKER_FAILURES and MCP_BREAKER_RESET_SECONDS
+        self._failure_threshold = failure_threshold
+        self._reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def failure_threshold(self) -> int:
+        return self._failure_threshold or get_settings().mcp_breaker_failures
+
+    @property
+    def reset_seconds(self) -> float:
+        return self._reset_seconds or get_settings().mcp_breaker_reset_seconds
+
+    def before_call(self):
+        if self.state == "closed":
+            return
+        if self.state == "open":
+            wait = self.reset_seconds - (time.monotonic() - self.opened_at)
+            if wait > 0:
+                metrics["breaker_rejections"] += 1
+                raise CircuitOpenError(f"The preferences API is unavailable; retry in {wait:.0f}s")
+            self.state = "half_open"
+        # Half open: let a single trial call through
+        if self._trial_in_flight:
+            metrics["breaker_rejections"] += 1
+            raise CircuitOpenError("The preferences API is recovering; retry shortly")
+        self._trial_in_flight = True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                metrics["breaker_opens"] += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        """Let another trial through after one that ended without an answer, e.g. was cancelled"""
+        self._trial_in_flight = False
+
+breaker = CircuitBreaker()
+
+metrics = defaultdict(int)
+# Per tool: calls, errors, total_ms, max_ms
+tool_latency = defaultdict(lambda: {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+
+async def request(client: httpx.AsyncClient, method: str, url: str, idempotent: bool, **kwargs) -> httpx.Response:
+    """Send a request within the time budget, retrying idempotent calls"""
+    settings = get_settings()
+    budget_seconds = settings.mcp_api_timeout_seconds
+    deadline = time.monotonic() + budget_seconds
+    attempts = 1 + (settings.mcp_api_retries if idempotent else 0)
+    headers = kwargs.pop("headers", None) or {}
+    for attempt in range(attempts):
+        breaker.before_call()
+        remaining = deadline - time.monotonic()
+        metrics["api_requests"] += 1
+        try:
+            with tracing.start_span(f"{method} {url}", tracing.CLIENT, attributes={
+                "http.method": method, "http.url": url, "retry.attempt": attempt
+            }) as span:
+                response = await client.request(
+                    method, url, timeout=remaining, headers=tracing.inject(dict(headers)), **kwargs
+                )
+                if span is not None:
+                    span.set_attribute("http.status_code", response.status_code)
+        except httpx.TransportError:
+            breaker.record_failure()
+            metrics["api_failures"] += 1
+            if attempt == attempts - 1:
+                raise
+        except BaseException:
+            # Cancellation or an unexpected error says nothing about the API's health
+            breaker.release_trial()
+            raise
+        else:
+            if response.status_code < 500:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            metrics["api_failures"] += 1
+            if attempt == attempts - 1:
+                return response
+
+        backoff = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+        if time.monotonic() + backoff >= deadline:
+            raise httpx.TimeoutException(f"Request to {url} exceeded its {budget_seconds}s budget")
+        metrics["api_retries"] += 1
+        await asyncio.sleep(backoff)
+
+def timed(fn):
+    """Record latency and error counts for an MCP tool"""
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        stats = tool_latency[fn.__name__]
+        try:
+            # Root of the trace that API calls made by the tool continue
+            with tracing.start_span(f"mcp.tool {fn.__name__}"):
+                result = await fn(*args, **kwargs)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        else:
+            if isinstance(result, dict) and result.get("status") == "error":
+                stats["errors"] += 1
+            return result
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats["calls"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+    return wrapper
+
+def snapshot() -> dict:
+    return {
+        "breaker": {"state": breaker.state, "consecutive_failures": breaker.failures},
+        "counters": dict(metrics),
+        "tools": {
+            name: {**stats, "avg_ms": stats["total_ms"] / stats["calls"] if stats["calls"] else 0.0}
+            for name, stats in tool_latency.items()
+        }
+    }
@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Any, List, Optional
+from broadcast import TOPIC_PATTERN
 
 class UserBase(BaseModel):
     username: str
@@ -18,9 +19,17 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     expires_in: int
+    refresh_token: Optional[str] = None
+    # Signed, versioned copy of the user's preferences, see snapshots.py
+    preferences_snapshot: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    user_id: Optional[int] = None
+    is_active: Optional[bool] = None
 
 # Preferences schemas
 class PreferencesBase(BaseModel):
@@ -34,9 +43,16 @@ class PreferencesCreate(PreferencesBase):
 class PreferencesUpdate(PreferencesBase):
     pass
 
+class DevicePreferencesUpdate(BaseModel):
+    """Overrides for one device; null clears an override so the user's value applies"""
+    theme: Optional[str] = None
+    language: Optional[str] = None
+    notifications: Optional[bool] = None
+
 class Preferences(PreferencesBase):
     id: int
     user_id: int
+    version: int = 1
     
     class Config:
         orm_mode = True
@@ -46,4 +62,15 @@ class UserWithPreferences(User):
     preferences: Optional[Preferences] = None
     
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class NotificationAck(BaseModel):
+    """Notification ids to mark as read; omit to acknowledge every notification"""
+    ids: Optional[List[int]] = None
+
+class BroadcastRequest(BaseModel):
+    """Set exactly one of topic, user_ids or everyone"""
+    message: Any
+    topic: Optional[str] = Field(None, pattern=TOPIC_PATTERN)
+    user_ids: Optional[List[int]] = None
+    everyone: bool = False
@@ -0,0 +1,49 @@
+"""
+JSON encoding helpers shared by HTTP responses and WebSocket pushes.
+Uses orjson when it is installed and enabled, otherwise the stdlib encoder.
+"""
+
+import json
+from typing import Any
+from starlette.responses import JSONResponse
+from config import get_settings
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+USE_ORJSON = orjson is not None and get_settings().json_serializer == "orjson"
+
+def dumps(content: Any) -> bytes:
+    """Encode content to compact UTF-8 JSON bytes"""
+    if USE_ORJSON:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with the configured serializer. Returning one of
+    these from a route also bypasses response_model validation, so it is only
+    used where the content is already built from trusted ORM fields.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def user_to_dict(user) -> dict:
+    return {
+        "username": user.username,
+        "id": user.id,
+        "is_active": user.is_active
+    }
+
+def preferences_to_dict(preferences) -> dict:
+    return {
+        "id": preferences.id,
+        "user_id": preferences.user_id,
+        "theme": preferences.theme,
+        "language": preferences.language,
+        "notifications": preferences.notifications,
+        "version": preferences.version
+    }
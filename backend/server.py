@@ -0,0 +1,112 @@
+"""
+Production entry point for the backend.
+
+    python server.py
+
+Runs a single uvicorn process, or a gunicorn master with WEB_CONCURRENCY
+uvicorn workers that share the app imported once before forking. uvloop and
+httptools are used when installed. On shutdown every open WebSocket is told
+to reconnect after a jittered delay before the server stops.
+"""
+
+import importlib.util
+from typing import List, Optional
+import socket
+
+import uvicorn
+from config import get_settings
+import passwords
+
+try:
+    from gunicorn.app.base import BaseApplication
+    from uvicorn.workers import UvicornWorker
+except ImportError:  # gunicorn is only needed for multiple workers
+    BaseApplication = None
+    UvicornWorker = None
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+LOOP = "uvloop" if _available("uvloop") else "asyncio"
+HTTP = "httptools" if _available("httptools") else "h11"
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that drains WebSockets before closing connections"""
+
+    async def shutdown(self, sockets: Optional[List[socket.socket]] = None) -> None:
+        from main import drain_websockets
+        await drain_websockets()
+        await super().shutdown(sockets=sockets)
+
+if UvicornWorker is not None:
+    class DrainingWorker(UvicornWorker):
+        CONFIG_KWARGS = {"loop": LOOP, "http": HTTP}
+
+        async def _serve(self) -> None:
+            self.config.app = self.wsgi
+            server = DrainingServer(config=self.config)
+            self._install_sigquit_handler()
+            await server.serve(sockets=self.sockets)
+            if not server.started:
+                raise SystemExit(3)  # gunicorn's WORKER_BOOT_ERROR
+
+    class Application(BaseApplication):
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            return app
+
+def prepare_schema():
+    """Create missing tables in the parent so forked workers skip it"""
+    from database import engine
+    from migrate import ensure_schema
+    from sharding import shard_engines
+    ensure_schema()
+    # Connections must not be shared with the forked workers
+    engine.dispose()
+    for shard_engine in shard_engines.values():
+        shard_engine.dispose()
+
+def run():
+    settings = get_settings()
+    if settings.auto_migrate:
+        prepare_schema()
+    # Calibrate password hashing once so every worker uses the same cost
+    passwords.configure()
+
+    print(f"Starting {settings.workers} worker(s) on {settings.host}:{settings.port} "
+          f"(loop={LOOP}, http={HTTP})")
+
+    if settings.workers <= 1:
+        from main import app
+        config = uvicorn.Config(
+            app,
+            host=settings.host,
+            port=settings.port,
+            loop=LOOP,
+            http=HTTP,
+            timeout_graceful_shutdown=settings.graceful_shutdown_timeout,
+        )
+        DrainingServer(config).run()
+        return
+
+    if BaseApplication is None:
+        raise SystemExit("gunicorn is required to run more than one worker")
+
+    Application({
+        "bind": f"{settings.host}:{settings.port}",
+        "workers": settings.workers,
+        "worker_class": "server.DrainingWorker",
+        "preload_app": True,
+        "graceful_timeout": settings.graceful_shutdown_timeout,
+    }).run()
+
+if __name__ == "__main__":
+    run()
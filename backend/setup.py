@@ -14,6 +14,7 @@ def setup_environment():
     packages = [
         "fastapi==0.104.1",
         "uvicorn==0.24.0",
+        "gunicorn==21.2.0",
         "sqlalchemy==2.0.23",
         "pydantic==2.4.2",
         "python-jose[cryptography]==3.3.0",
@@ -21,6 +22,7 @@ def setup_environment():
         "python-multipart==0.0.6",
         "httpx==0.25.1",
         "fastmcp==0.1.0",
+        "orjson==3.9.10",
         "passlib==1.7.4",
         "bcrypt==4.0.1",  # Use this specific version to fix compatibility
     ]
@@ -0,0 +1,152 @@
+"""
+Optional sharding of the preferences tables by user_id.
+
+Set PREFERENCES_SHARD_URLS to a comma-separated list of database URLs. Each
+user's preferences row and device overrides live on the shard picked by a
+consistent hash of the user id, so SQLite writes for different users no
+longer share one lock.
+Users and every other table stay on DATABASE_URL.
+
+After changing the shard list, move rows to their new owners with:
+
+    python sharding.py rebalance [--from OLD_URL ...]
+
+--from adds databases that are no longer in the list (including
+DATABASE_URL when sharding is first enabled) as sources to drain.
+"""
+
+import bisect
+import hashlib
+import sys
+from sqlalchemy import MetaData, create_engine
+from sqlalchemy.pool import StaticPool
+from config import get_settings
+
+# Tables whose rows are placed by user_id
+SHARDED_TABLES = {"preferences", "device_preferences"}
+# Points per shard on the ring; more points give a more even spread
+VIRTUAL_NODES = 64
+
+def create_engine_for(url: str):
+    # SQLite connections are shared across FastAPI's threadpool
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        # Every pooled connection would otherwise get its own empty database
+        return create_engine(url, connect_args=connect_args, poolclass=StaticPool)
+    return create_engine(url, connect_args=connect_args)
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class HashRing:
+    """Consistent hash ring; adding or removing a shard only moves about 1/N of the keys"""
+
+    def __init__(self, nodes, vnodes: int = VIRTUAL_NODES):
+        self._points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in self._points]
+
+    def node_for(self, key) -> str:
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._points)
+        return self._points[index][1]
+
+SHARD_URLS = get_settings().preferences_shard_urls
+shard_engines = {url: create_engine_for(url) for url in SHARD_URLS}
+ring = HashRing(SHARD_URLS) if SHARD_URLS else None
+
+def is_sharded(mapper) -> bool:
+    return ring is not None and mapper is not None and mapper.local_table.name in SHARDED_TABLES
+
+def shard_engine_for(user_id: int):
+    return shard_engines[ring.node_for(user_id)]
+
+def _shard_metadata() -> MetaData:
+    """
+    The sharded tables and the preference_stats counters they feed. Foreign
+    keys to users are dropped, since users lives in another database.
+    """
+    import models
+    metadata = MetaData()
+    for name in sorted(SHARDED_TABLES | {models.PreferenceStat.__tablename__}):
+        table = models.Base.metadata.tables[name].to_metadata(metadata)
+        for constraint in list(table.foreign_key_constraints):
+            table.constraints.discard(constraint)
+        table.foreign_keys.clear()
+        for column in table.columns:
+            column.foreign_keys.clear()
+    return metadata
+
+def create_shard_schemas():
+    """Create the sharded tables on every shard"""
+    from migrate import run_migrations
+    metadata = _shard_metadata()
+    for shard_engine in shard_engines.values():
+        run_migrations(shard_engine, metadata)
+
+def _sharded_models():
+    """Sharded models with the columns that identify a row on its target shard"""
+    import models
+    return [
+        (models.Preferences, ("user_id",)),
+        (models.DevicePreferences, ("user_id", "device")),
+    ]
+
+def rebalance(extra_sources=(), batch_size: int = 500):
+    """Move every sharded row to the shard that owns its user_id"""
+    from sqlalchemy.orm import Session
+    # Moved rows are counted on their new shard and removed from the old one
+    import stats  # noqa: F401
+
+    sources = dict(shard_engines)
+    for url in extra_sources:
+        sources.setdefault(url, create_engine_for(url))
+
+    total_moved = 0
+    for model, identity in _sharded_models():
+        # Row ids are per shard, so the target assigns a new one
+        copied = [column.key for column in model.__table__.columns if column.key != "id"]
+        for url, source in sources.items():
+            moved = 0
+            last_id = 0
+            with Session(bind=source) as src:
+                while True:
+                    rows = src.query(model).filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+                    if not rows:
+                        break
+                    last_id = rows[-1].id
+
+                    by_target = {}
+                    for row in rows:
+                        target = ring.node_for(row.user_id)
+                        if target != url:
+                            by_target.setdefault(target, []).append(row)
+
+                    for target, misplaced in by_target.items():
+                        with Session(bind=shard_engines[target]) as dst:
+                            existing = {
+                                tuple(getattr(p, key) for key in identity): p for p in dst.query(model).filter(
+                                    model.user_id.in_([r.user_id for r in misplaced])
+                                )
+                            }
+                            for row in misplaced:
+                                copy = existing.get(tuple(getattr(row, key) for key in identity)) or model()
+                                for key in copied:
+                                    setattr(copy, key, getattr(row, key))
+                                dst.add(copy)
+                            dst.commit()
+                        for row in misplaced:
+                            src.delete(row)
+                        src.commit()
+                        moved += len(misplaced)
+                    src.expunge_all()
+            print(f"{url}: moved {moved} {model.__tablename__} row(s)")
+            total_moved += moved
+    return total_moved
+
+if __name__ == "__main__":
+    if ring is None or len(sys.argv) < 2 or sys.argv[1] != "rebalance":
+        print("Usage: PREFERENCES_SHARD_URLS=... python sharding.py rebalance [--from URL ...]")
+        sys.exit(1)
+    args = sys.argv[2:]
+    extra = [args[i + 1] for i, arg in enumerate(args) if arg == "--from" and i + 1 < len(args)]
+    create_shard_schemas()
+    print(f"Rebalanced {rebalance(extra)} row(s) across {len(SHARD_URLS)} shard(s)")
@@ -0,0 +1,54 @@
+"""
+Signed preferences snapshots.
+
+Login and refresh return the user's preferences as a compact JWT next to the
+tokens, so the SPA can render the right theme and language before making any
+request. "ver" is the row's version. GET /preferences uses the user id and
+version as its ETag and answers 304 while the client's If-None-Match still names it, so a
+stale snapshot is detected without transferring the row. A GET that returns
+the row, and every update, send a fresh snapshot in the X-Preferences-Snapshot
+header for the client to keep.
+"""
+
+from typing import Optional
+import models
+import tokens
+from serialization import preferences_to_dict
+
+# Distinguishes snapshots from access tokens, which carry "sub" instead
+SNAPSHOT_TYPE = "preferences"
+SNAPSHOT_HEADER = "X-Preferences-Snapshot"
+
+def create(user_id: int, preferences: Optional[models.Preferences]) -> str:
+    """Snapshot of preferences; a user without a row gets the defaults at version 0"""
+    if preferences is None:
+        preferences = models.Preferences(
+            user_id=user_id, theme="light", language="english", notifications=True, version=0
+        )
+    return from_dict(preferences_to_dict(preferences))
+
+def from_dict(prefs_dict: dict) -> str:
+    """Snapshot of preferences already serialized with preferences_to_dict"""
+    return tokens.encode({
+        "typ": SNAPSHOT_TYPE,
+        "uid": prefs_dict["user_id"],
+        "ver": prefs_dict["version"],
+        "theme": prefs_dict["theme"],
+        "language": prefs_dict["language"],
+        "notifications": prefs_dict["notifications"]
+    })
+
+def headers(prefs_dict: dict) -> dict:
+    """ETag and fresh snapshot for a response carrying the preferences"""
+    return {"ETag": etag(prefs_dict["user_id"], prefs_dict["version"]), SNAPSHOT_HEADER: from_dict(prefs_dict)}
+
+def etag(user_id: int, version: int) -> str:
+    """Names the user as well, since versions of different users' rows coincide"""
+    return f'"{user_id}-{version}"'
+
+def is_current(if_none_match: Optional[str], user_id: int, version: int) -> bool:
+    """Whether an If-None-Match header names this user's row at this version"""
+    if not if_none_match:
+        return False
+    tag = etag(user_id, version)
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in if_none_match.split(","))
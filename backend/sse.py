@@ -0,0 +1,58 @@
+"""
+Server-Sent Events connections.
+An SSEConnection sits in the same registry as WebSockets (connected_clients)
+and buffers events for the streaming response that drains it.
+"""
+
+import asyncio
+from typing import Optional
+
+class BufferFull(Exception):
+    """Raised when a slow client lets its buffer fill up"""
+
+def format_event(data: str, event_id: Optional[int] = None, retry_ms: Optional[int] = None) -> str:
+    lines = []
+    if retry_ms is not None:
+        lines.append(f"retry: {retry_ms}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {data}")
+    return "\n".join(lines) + "\n\n"
+
+HEARTBEAT = ": ping\n\n"
+
+class SSEConnection:
+    def __init__(self, buffer_size: int):
+        self._queue = asyncio.Queue(maxsize=buffer_size)
+        self.closed = False
+
+    def push(self, message: str, event_id: Optional[int] = None):
+        """Queue an event; a full buffer closes the connection so the client resumes"""
+        if self.closed:
+            raise BufferFull("connection closed")
+        try:
+            self._queue.put_nowait(format_event(message, event_id))
+        except asyncio.QueueFull:
+            self.closed = True
+            raise BufferFull("client is not keeping up")
+
+    async def send_text(self, message: str):
+        # Same signature as WebSocket.send_text, used for untracked messages
+        self.push(message)
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        try:
+            # Wake the stream so it ends without waiting for the next heartbeat
+            self._queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    async def next_chunk(self, heartbeat_seconds: float) -> Optional[str]:
+        """Next event to write, a heartbeat when idle, or None once closed"""
+        if self.closed and self._queue.empty():
+            return None
+        try:
+            return await asyncio.wait_for(self._queue.get(), heartbeat_seconds)
+        except asyncio.TimeoutError:
+            return None if self.closed else HEARTBEAT
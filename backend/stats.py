@@ -0,0 +1,107 @@
+"""
+Counters of preferences per theme, language and notifications value.
+
+Every insert, update and delete of a preferences row adjusts the counters in
+preference_stats on the same connection, so they commit or roll back with the
+row. With sharding each shard counts its own rows and readers add them up.
+Reading the stats costs one small query per database at any user count.
+
+To reconcile after writes that bypassed the ORM (bulk SQL, restores), run:
+
+    python stats.py rebuild
+
+Rebuild recounts inside one transaction per database; on databases other
+than SQLite, run it when preference writes are quiet.
+"""
+
+import sys
+from collections import defaultdict
+from sqlalchemy import delete, event, func, inspect, insert, select, update
+import models
+
+DIMENSIONS = ("theme", "language", "notifications")
+
+_table = models.PreferenceStat.__table__
+
+def _key(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+def _bump(connection, deltas: dict):
+    for (dimension, value), delta in deltas.items():
+        if not delta or value is None:
+            continue
+        if connection.dialect.name in ("sqlite", "postgresql"):
+            if connection.dialect.name == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as upsert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as upsert
+            connection.execute(
+                upsert(_table).values(dimension=dimension, value=value, count=delta).on_conflict_do_update(
+                    index_elements=["dimension", "value"], set_={"count": _table.c.count + delta}
+                )
+            )
+            continue
+        updated = connection.execute(
+            update(_table).where(_table.c.dimension == dimension, _table.c.value == value)
+            .values(count=_table.c.count + delta)
+        ).rowcount
+        if not updated:
+            connection.execute(insert(_table).values(dimension=dimension, value=value, count=delta))
+
+@event.listens_for(models.Preferences, "after_insert")
+def _count_insert(mapper, connection, target):
+    _bump(connection, {(dimension, _key(getattr(target, dimension))): 1 for dimension in DIMENSIONS})
+
+@event.listens_for(models.Preferences, "after_delete")
+def _count_delete(mapper, connection, target):
+    _bump(connection, {(dimension, _key(getattr(target, dimension))): -1 for dimension in DIMENSIONS})
+
+@event.listens_for(models.Preferences, "after_update")
+def _count_update(mapper, connection, target):
+    deltas = defaultdict(int)
+    state = inspect(target)
+    for dimension in DIMENSIONS:
+        history = state.attrs[dimension].history
+        # deleted holds the previous value when it was loaded before the change
+        if not history.has_changes() or not history.deleted:
+            continue
+        deltas[(dimension, _key(history.deleted[0]))] -= 1
+        deltas[(dimension, _key(getattr(target, dimension)))] += 1
+    _bump(connection, deltas)
+
+def read(sessions) -> dict:
+    """Add up the counters from each database holding preferences"""
+    stats = {dimension: defaultdict(int) for dimension in DIMENSIONS}
+    for db in sessions:
+        for row in db.query(models.PreferenceStat).filter(models.PreferenceStat.count != 0):
+            if row.dimension in stats:
+                stats[row.dimension][row.value] += row.count
+    result = {dimension: dict(sorted(counts.items())) for dimension, counts in stats.items()}
+    return {"total": sum(result["theme"].values()), **result}
+
+def rebuild(bind) -> int:
+    """Recount the preferences table on this engine; returns the number of rows counted"""
+    with bind.begin() as connection:
+        connection.execute(delete(_table))
+        total = 0
+        for dimension in DIMENSIONS:
+            column = getattr(models.Preferences, dimension)
+            rows = connection.execute(select(column, func.count()).group_by(column)).all()
+            deltas = {(dimension, _key(value)): count for value, count in rows}
+            _bump(connection, deltas)
+            if dimension == "theme":
+                total = sum(count for _, count in rows)
+    return total
+
+if __name__ == "__main__":
+    from database import engine
+    from sharding import shard_engines
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("Usage: python stats.py rebuild")
+        sys.exit(1)
+    for bind in [engine, *shard_engines.values()]:
+        print(f"{bind.url}: counted {rebuild(bind)} preferences row(s)")
@@ -0,0 +1,131 @@
+"""
+JWT encoding and verification.
+
+JWT_BACKEND selects the library: "jose" (python-jose, default) or "pyjwt".
+Verified tokens are kept in a bounded LRU keyed by a SHA-256 digest of the
+token until their exp, so repeat requests with the same bearer token skip
+the signature check. TOKEN_CACHE_SIZE=0 disables the cache.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from config import get_settings
+
+class TokenError(Exception):
+    """The token is malformed, has a bad signature or has expired"""
+
+class JoseBackend:
+    def __init__(self):
+        from jose import JWTError, jwt
+        self._jwt = jwt
+        self._error = JWTError
+
+    def encode(self, claims: dict, key: str, algorithm: str) -> str:
+        return self._jwt.encode(claims, key, algorithm=algorithm)
+
+    def decode(self, token: str, key: str, algorithm: str) -> dict:
+        try:
+            return self._jwt.decode(token, key, algorithms=[algorithm])
+        except self._error as e:
+            raise TokenError(str(e))
+
+class PyJWTBackend:
+    def __init__(self):
+        import jwt
+        self._jwt = jwt
+
+    def encode(self, claims: dict, key: str, algorithm: str) -> str:
+        return self._jwt.encode(claims, key, algorithm=algorithm)
+
+    def decode(self, token: str, key: str, algorithm: str) -> dict:
+        try:
+            return self._jwt.decode(token, key, algorithms=[algorithm])
+        except self._jwt.PyJWTError as e:
+            raise TokenError(str(e))
+
+BACKENDS = {"jose": JoseBackend, "pyjwt": PyJWTBackend}
+
+class VerifiedTokenCache:
+    """LRU of decoded claims by token digest; entries expire with the token"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._digest(token)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None and payload["exp"] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return payload
+            if payload is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, payload: dict):
+        # Tokens without an expiry are never cached
+        if self.max_size <= 0 or not isinstance(payload.get("exp"), (int, float)):
+            return
+        key = self._digest(token)
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+_backend = None
+_cache = None
+
+def backend():
+    global _backend
+    if _backend is None:
+        name = get_settings().jwt_backend
+        if name not in BACKENDS:
+            raise RuntimeError(f"JWT_BACKEND must be one of {', '.join(BACKENDS)}")
+        _backend = BACKENDS[name]()
+    return _backend
+
+def cache() -> VerifiedTokenCache:
+    global _cache
+    if _cache is None:
+        _cache = VerifiedTokenCache(get_settings().token_cache_size)
+    return _cache
+
+def encode(claims: dict) -> str:
+    settings = get_settings()
+    return backend().encode(claims, settings.secret_key, settings.algorithm)
+
+def decode(token: str) -> dict:
+    """Verified claims of token, shared with the cache so not to be modified; raises TokenError"""
+    verified = cache()
+    if verified.max_size > 0:
+        payload = verified.get(token)
+        if payload is not None:
+            return payload
+    settings = get_settings()
+    payload = backend().decode(token, settings.secret_key, settings.algorithm)
+    verified.put(token, payload)
+    return payload
@@ -0,0 +1,264 @@
+"""
+Lightweight distributed tracing.
+
+Spans are propagated between processes with the W3C traceparent header and
+written to TRACE_FILE as OTLP/JSON, one export request per line. The
+OpenTelemetry Collector reads that format with its otlpjsonfile receiver, and
+it can be sent as-is to any OTLP/HTTP endpoint. TRACE_SAMPLE_RATIO picks the
+fraction of new traces to record; requests that arrive with a traceparent
+follow the caller's decision. Tracing is off unless TRACE_FILE is set.
+"""
+
+import atexit
+import functools
+import inspect
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from config import get_settings
+
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+# Longest SQL statement kept on a span
+MAX_STATEMENT_LENGTH = 500
+
+class SpanContext:
+    """Identity of a span, as carried by traceparent"""
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+class Span(SpanContext):
+    __slots__ = ("parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, kind: int, parent: Optional[SpanContext], sampled: bool):
+        super().__init__(parent.trace_id if parent else os.urandom(16).hex(), os.urandom(8).hex(), sampled)
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+class FileExporter:
+    """Buffers finished spans and appends them to a file from a background thread"""
+
+    def __init__(self, path: str, service_name: str, interval_seconds: float = 1.0):
+        self.path = path
+        self.service_name = service_name
+        self.interval_seconds = interval_seconds
+        self._spans = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def export(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if not spans:
+            return
+        request = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "preferences"}, "spans": [span.to_otlp() for span in spans]}]
+        }]}
+        # One line per write so processes sharing the file do not interleave
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(request, separators=(",", ":")) + "\n")
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_exporter: Optional[FileExporter] = None
+_sample_ratio = 1.0
+
+def configure(service_name: str):
+    """Enable tracing when TRACE_FILE is set; the first caller in a process names the service"""
+    global _exporter, _sample_ratio
+    settings = get_settings()
+    if _exporter is not None or not settings.trace_file:
+        return
+    _sample_ratio = settings.trace_sample_ratio
+    _exporter = FileExporter(settings.trace_file, service_name)
+    atexit.register(_exporter.flush)
+    _instrument_sqlalchemy()
+
+def enabled() -> bool:
+    return _exporter is not None
+
+def flush():
+    """Write buffered spans now, e.g. on shutdown"""
+    if _exporter is not None:
+        _exporter.flush()
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def begin(name: str, kind: int = INTERNAL, parent: Optional[SpanContext] = None, attributes: dict = None) -> Optional[Span]:
+    """Start a span without making it current; finish it with finish()"""
+    if _exporter is None:
+        return None
+    parent = parent or _current_span.get()
+    sampled = parent.sampled if parent else random.random() < _sample_ratio
+    span = Span(name, kind, parent, sampled)
+    if attributes and sampled:
+        span.attributes.update(attributes)
+    return span
+
+def finish(span: Optional[Span], error: Optional[BaseException] = None):
+    if span is None:
+        return
+    span.end_ns = time.time_ns()
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"
+    if span.sampled:
+        _exporter.export(span)
+
+@contextmanager
+def start_span(name: str, kind: int = INTERNAL, parent: Optional[SpanContext] = None, attributes: dict = None):
+    """Span around a block, current for everything called inside it; yields None when tracing is off"""
+    span = begin(name, kind, parent, attributes)
+    if span is None:
+        yield None
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        finish(span, e)
+        raise
+    else:
+        finish(span)
+    finally:
+        _current_span.reset(token)
+
+def traced(name: str):
+    """Decorator recording a span around each call of a sync or async function"""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with start_span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with start_span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def inject(headers: dict) -> dict:
+    """Add the current span's traceparent to outgoing headers"""
+    span = _current_span.get()
+    if span is not None:
+        headers["traceparent"] = f"00-{span.trace_id}-{span.span_id}-{'01' if span.sampled else '00'}"
+    return headers
+
+def extract(traceparent: Optional[str]) -> Optional[SpanContext]:
+    if not traceparent:
+        return None
+    parts = traceparent.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3][:2], 16)
+    except ValueError:
+        return None
+    return SpanContext(parts[1], parts[2], bool(flags & 1))
+
+class TracingMiddleware:
+    """ASGI middleware opening a server span per HTTP request, continuing the caller's trace"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _exporter is None:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        parent = extract(headers.get(b"traceparent", b"").decode("latin-1"))
+        with start_span(f"{scope['method']} {scope['path']}", SERVER, parent, {
+            "http.method": scope["method"],
+            "http.target": scope["path"],
+        }) as span:
+            async def send_with_status(message):
+                if message["type"] == "http.response.start" and span is not None:
+                    span.set_attribute("http.status_code", message["status"])
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
+            route = scope.get("route")
+            if span is not None and getattr(route, "path", None):
+                # Name by route template so spans group across ids in the path
+                span.name = f"{scope['method']} {route.path}"
+
+def _instrument_sqlalchemy():
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        # Only statements inside a traced request or tool call
+        if _current_span.get() is None:
+            return
+        context._trace_span = begin("db.query", CLIENT, attributes={
+            "db.system": conn.dialect.name,
+            "db.statement": statement[:MAX_STATEMENT_LENGTH],
+        })
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        finish(getattr(context, "_trace_span", None))
+
+    @event.listens_for(Engine, "handle_error")
+    def _error(exception_context):
+        context = exception_context.execution_context
+        if context is not None:
+            finish(getattr(context, "_trace_span", None), exception_context.original_exception)
@@ -0,0 +1,70 @@
+"""
+In-memory Bloom filter of registered usernames.
+A username the filter has never seen is certainly free, so most availability
+checks are answered without a query; only possible matches hit the unique
+index. Each process loads the filter at startup and picks up users registered
+by other workers with an indexed range scan on users.id, at most every
+USERNAME_FILTER_REFRESH_SECONDS.
+"""
+
+import hashlib
+import math
+import time
+from sqlalchemy.orm import Session
+from config import get_settings
+import models
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        # Standard sizing for the target false positive rate at capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        # Double hashing: k positions from two 64-bit halves
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+username_filter = BloomFilter(get_settings().username_filter_capacity)
+# Highest users.id loaded into the filter, and when new rows were last checked for
+_last_user_id = 0
+_last_refresh = 0.0
+
+def refresh(db: Session, batch_size: int = 5000) -> int:
+    """Add users created since the last refresh; returns how many were added"""
+    global _last_user_id, _last_refresh
+    added = 0
+    while True:
+        rows = db.query(models.User.id, models.User.username).filter(
+            models.User.id > _last_user_id
+        ).order_by(models.User.id).limit(batch_size).all()
+        for row in rows:
+            username_filter.add(row.username)
+        if rows:
+            _last_user_id = rows[-1].id
+        added += len(rows)
+        if len(rows) < batch_size:
+            break
+    _last_refresh = time.monotonic()
+    return added
+
+def add(username: str):
+    username_filter.add(username)
+
+def is_available(db: Session, username: str) -> bool:
+    if time.monotonic() - _last_refresh > get_settings().username_filter_refresh_seconds:
+        refresh(db)
+    if username not in username_filter:
+        return True
+    # Possible match: confirm against the unique index
+    return db.query(models.User.id).filter(models.User.username == username).first() is None
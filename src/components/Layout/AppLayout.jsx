@@ -2,6 +2,10 @@ import React, { useEffect } from "react";
 import Navbar from "../Navbar/Navbar";
 import { useDispatch, useSelector } from "react-redux";
 import { fetchPreferences } from "../../store/preferencesSlice";
+import {
+  connectPreferencesSocket,
+  disconnectPreferencesSocket,
+} from "../../store/preferencesSocket";
 import Toast from "../Toast/Toast";
 import { useTranslation } from "react-i18next";
 import useAuth from "../../hooks/useAuth";
@@ -16,8 +20,14 @@ const AppLayout = ({ children }) => {
   const { claudeActive } = useClaudeIntegration();
 
   useEffect(() => {
-    // Fetch preferences when the component mounts
-    dispatch(fetchPreferences());
+    // Fetch preferences when the component mounts, then follow live updates
+    dispatch(fetchPreferences()).then((action) => {
+      const userId = action.payload?.user_id;
+      if (userId) {
+        connectPreferencesSocket(userId, dispatch);
+      }
+    });
+    return () => disconnectPreferencesSocket();
   }, [dispatch]);
 
   useEffect(() => {
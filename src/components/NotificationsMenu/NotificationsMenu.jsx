@@ -5,6 +5,8 @@ import { useSelector, useDispatch } from "react-redux";
 import {
   markNotificationRead,
   clearNotifications,
+  fetchNotifications,
+  acknowledgeNotifications,
 } from "../../store/notificationsSlice";
 
 function NotificationsMenu({ isMobile = false }) {
@@ -33,11 +35,24 @@ function NotificationsMenu({ isMobile = false }) {
     };
   }, []);
 
+  // Load the newest page of the server inbox
+  useEffect(() => {
+    if (localStorage.getItem("token")) {
+      dispatch(fetchNotifications());
+    }
+  }, [dispatch]);
+
   const handleMarkAsRead = (id) => {
     dispatch(markNotificationRead(id));
+    if (typeof id === "number") {
+      dispatch(acknowledgeNotifications([id]));
+    }
   };
 
   const handleClearAll = () => {
+    if (notifications.some((note) => typeof note.id === "number" && !note.read)) {
+      dispatch(acknowledgeNotifications());
+    }
     dispatch(clearNotifications());
     setIsOpen(false);
   };
@@ -3,6 +3,83 @@ import { useNavigate } from "react-router";
 
 const API_BASE_URL = "http://localhost:8000";
 
+const clearTokens = () => {
+  localStorage.removeItem("token");
+  localStorage.removeItem("refreshToken");
+  localStorage.removeItem("preferencesSnapshot");
+};
+
+// Signed preferences returned with every token pair; preferencesSlice renders
+// from it at startup and revalidates in the background
+const storeTokens = (data) => {
+  localStorage.setItem("token", data.access_token);
+  if (data.refresh_token) {
+    localStorage.setItem("refreshToken", data.refresh_token);
+  }
+  if (data.preferences_snapshot) {
+    localStorage.setItem("preferencesSnapshot", data.preferences_snapshot);
+  }
+};
+
+// Exchange the stored refresh token for a new token pair instead of
+// sending the user back to the login form
+const requestRefresh = async () => {
+  const refreshToken = localStorage.getItem("refreshToken");
+  if (!refreshToken) {
+    return false;
+  }
+
+  try {
+    const res = await fetch(`${API_BASE_URL}/auth/refresh`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ refresh_token: refreshToken }),
+    });
+    if (!res.ok) {
+      return false;
+    }
+    storeTokens(await res.json());
+    return true;
+  } catch (error) {
+    return false;
+  }
+};
+
+// Requests that get a 401 at the same time share one refresh: presenting the
+// rotated-out refresh token a second time would revoke the whole session
+let refreshInFlight = null;
+
+export const refreshSession = () => {
+  if (!refreshInFlight) {
+    refreshInFlight = requestRefresh().finally(() => {
+      refreshInFlight = null;
+    });
+  }
+  return refreshInFlight;
+};
+
+// fetch with the stored access token; on a 401 the session is refreshed and
+// the request sent once more with the new token
+export const authFetch = async (url, options = {}) => {
+  const send = () =>
+    fetch(url, {
+      ...options,
+      // Sends the API's recent_write cookie, which keeps reads after a
+      // write on the primary database
+      credentials: "include",
+      headers: {
+        ...options.headers,
+        Authorization: `Bearer ${localStorage.getItem("token")}`,
+      },
+    });
+
+  const res = await send();
+  if (res.status === 401 && (await refreshSession())) {
+    return send();
+  }
+  return res;
+};
+
 export function useAuth() {
   const navigate = useNavigate();
   const [error, setError] = useState(null);
@@ -20,23 +97,19 @@ export function useAuth() {
       }
 
       try {
-        const res = await fetch(`${API_BASE_URL}/auth/validate-token`, {
-          headers: {
-            Authorization: `Bearer ${token}`,
-          },
-        });
+        const res = await authFetch(`${API_BASE_URL}/auth/validate-token`);
 
         if (res.ok) {
           const data = await res.json();
           setUser(data.data);
           setIsAuthenticated(true);
         } else {
-          localStorage.removeItem("token");
+          clearTokens();
           setIsAuthenticated(false);
         }
       } catch (error) {
         setIsAuthenticated(false);
-        localStorage.removeItem("token");
+        clearTokens();
       }
       setIsLoading(false);
     };
@@ -83,7 +156,7 @@ export function useAuth() {
         return false;
       }
 
-      localStorage.setItem("token", data.access_token);
+      storeTokens(data);
       setIsAuthenticated(true);
       navigate("/home");
       return true;
@@ -94,7 +167,15 @@ export function useAuth() {
   };
 
   const logout = () => {
-    localStorage.removeItem("token");
+    const refreshToken = localStorage.getItem("refreshToken");
+    if (refreshToken) {
+      fetch(`${API_BASE_URL}/auth/revoke`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ refresh_token: refreshToken }),
+      }).catch(() => {});
+    }
+    clearTokens();
     setIsAuthenticated(false);
     setUser(null);
     navigate("/login");
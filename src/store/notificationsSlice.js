@@ -1,10 +1,56 @@
-import { createSlice } from "@reduxjs/toolkit";
+import { createSlice, createAsyncThunk } from "@reduxjs/toolkit";
 import { v4 as uuidv4 } from "uuid";
+import { authFetch } from "../hooks/useAuth";
+
+const API_BASE_URL = "http://localhost:8000";
 
 const initialState = {
   notifications: [],
+  // Cursor for the next page of the server inbox, null when there are no more
+  nextCursor: null,
 };
 
+// Inbox notifications use their numeric server id; local ones a uuid
+const fromServer = (notification) => ({
+  id: notification.id,
+  timestamp: notification.created_at,
+  read: notification.acknowledged,
+  message: typeof notification.message === "string" ? notification.message : undefined,
+  data: notification.message,
+});
+
+// Pass the previous nextCursor to load older notifications
+export const fetchNotifications = createAsyncThunk(
+  "notifications/fetchNotifications",
+  async (cursor = null, { rejectWithValue }) => {
+    if (!localStorage.getItem("token")) return rejectWithValue("No authentication token");
+
+    const params = new URLSearchParams({ limit: "50" });
+    if (cursor) params.set("cursor", cursor);
+    const response = await authFetch(`${API_BASE_URL}/notifications?${params}`);
+    if (!response.ok) return rejectWithValue("Failed to fetch notifications");
+    return response.json();
+  }
+);
+
+// Acknowledge inbox notifications in one request; no ids acknowledges all
+export const acknowledgeNotifications = createAsyncThunk(
+  "notifications/acknowledgeNotifications",
+  async (ids = null, { rejectWithValue }) => {
+    if (!localStorage.getItem("token")) return rejectWithValue("No authentication token");
+
+    const response = await authFetch(`${API_BASE_URL}/notifications/ack`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify(ids ? { ids } : {}),
+    });
+    if (!response.ok) return rejectWithValue("Failed to acknowledge notifications");
+    return ids;
+  }
+);
+
 const notificationsSlice = createSlice({
   name: "notifications",
   initialState,
@@ -34,10 +80,40 @@ const notificationsSlice = createSlice({
     clearNotifications: (state) => {
       state.notifications = [];
     },
+    // Live "notification" messages and "notifications_backfill" batches;
+    // the same notification can arrive through both, so dedupe by id
+    receiveNotifications: (state, action) => {
+      const known = new Set(state.notifications.map((n) => n.id));
+      action.payload
+        .filter((notification) => !known.has(notification.id))
+        .forEach((notification) => state.notifications.unshift(fromServer(notification)));
+    },
+  },
+  extraReducers: (builder) => {
+    builder
+      .addCase(fetchNotifications.fulfilled, (state, action) => {
+        const known = new Set(state.notifications.map((n) => n.id));
+        action.payload.notifications
+          .filter((notification) => !known.has(notification.id))
+          .forEach((notification) => state.notifications.push(fromServer(notification)));
+        state.nextCursor = action.payload.next_cursor;
+      })
+      .addCase(acknowledgeNotifications.fulfilled, (state, action) => {
+        const ids = action.payload ? new Set(action.payload) : null;
+        state.notifications.forEach((notification) => {
+          if (!ids || ids.has(notification.id)) {
+            notification.read = true;
+          }
+        });
+      });
   },
 });
 
-export const { addNotification, markNotificationRead, clearNotifications } =
-  notificationsSlice.actions;
+export const {
+  addNotification,
+  markNotificationRead,
+  clearNotifications,
+  receiveNotifications,
+} = notificationsSlice.actions;
 
 export default notificationsSlice.reducer;
@@ -1,5 +1,6 @@
 import { createSlice, createAsyncThunk } from "@reduxjs/toolkit";
 import i18n from "../i18n/i18n";
+import { authFetch } from "../hooks/useAuth";
 
 const API_BASE_URL = "http://localhost:8000";
 
@@ -10,6 +11,35 @@ const defaultPreferences = {
   notifications: true,
 };
 
+// Preferences from the snapshot issued with the last login, refresh or
+// preferences response. Only the payload is read here.
+export const readPreferencesSnapshot = () => {
+  const snapshot = localStorage.getItem("preferencesSnapshot");
+  if (!snapshot) return null;
+  try {
+    const payload = snapshot.split(".")[1].replace(/-/g, "+").replace(/_/g, "/");
+    const claims = JSON.parse(atob(payload));
+    return {
+      theme: claims.theme,
+      language: claims.language,
+      notifications: claims.notifications,
+      version: claims.ver,
+      user_id: claims.uid,
+    };
+  } catch (error) {
+    return null;
+  }
+};
+
+// Keep the snapshot sent with fresh preferences, so the next start renders
+// them and revalidates against their version
+const storePreferencesSnapshot = (response) => {
+  const snapshot = response.headers.get("X-Preferences-Snapshot");
+  if (snapshot) {
+    localStorage.setItem("preferencesSnapshot", snapshot);
+  }
+};
+
 // This function applies theme according to Tailwind CSS guidelines
 export const applyThemeClass = (theme) => {
   // For Tailwind, we only need to toggle the 'dark' class
@@ -60,15 +90,27 @@ export const fetchPreferences = createAsyncThunk(
       return defaultPreferences;
     }
 
+    // Render from the snapshot right away, then only download the
+    // preferences if their version has changed since it was issued
+    const snapshot = readPreferencesSnapshot();
+    if (snapshot) {
+      applyThemeClass(snapshot.theme);
+      applyLanguage(snapshot.language);
+    }
+
     try {
-      const response = await fetch(`${API_BASE_URL}/preferences`, {
-        headers: {
-          Authorization: `Bearer ${token}`,
-        },
-      });
+      const headers = {};
+      if (snapshot) {
+        headers["If-None-Match"] = `"${snapshot.user_id}-${snapshot.version}"`;
+      }
+      const response = await authFetch(`${API_BASE_URL}/preferences`, { headers });
 
+      if (response.status === 304) {
+        return snapshot;
+      }
       if (response.ok) {
         const data = await response.json();
+        storePreferencesSnapshot(response);
         applyThemeClass(data.theme);
         applyLanguage(data.language);
         return data;
@@ -90,21 +132,20 @@ export const fetchPreferences = createAsyncThunk(
 export const updatePreferences = createAsyncThunk(
   "preferences/updatePreferences",
   async (newPreferences, { rejectWithValue }) => {
-    const token = localStorage.getItem("token");
-    if (!token) return rejectWithValue("No authentication token");
+    if (!localStorage.getItem("token")) return rejectWithValue("No authentication token");
 
     try {
-      const response = await fetch(`${API_BASE_URL}/preferences`, {
+      const response = await authFetch(`${API_BASE_URL}/preferences`, {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
-          Authorization: `Bearer ${token}`,
         },
         body: JSON.stringify(newPreferences),
       });
 
       if (response.ok) {
         const data = await response.json();
+        storePreferencesSnapshot(response);
         applyThemeClass(data.theme);
         applyLanguage(data.language);
         return data;
@@ -120,7 +161,7 @@ export const updatePreferences = createAsyncThunk(
 const preferencesSlice = createSlice({
   name: "preferences",
   initialState: {
-    preferences: defaultPreferences,
+    preferences: readPreferencesSnapshot() || defaultPreferences,
     status: "idle", // 'idle' | 'loading' | 'succeeded' | 'failed'
     error: null,
     claudeActive: false, // New state to track Claude activity
@@ -137,6 +178,10 @@ const preferencesSlice = createSlice({
     setClaudeActive: (state, action) => {
       state.claudeActive = action.payload;
     },
+    // Preferences pushed by the server over the WebSocket
+    updatePreferencesFromWs: (state, action) => {
+      state.preferences = { ...state.preferences, ...action.payload };
+    },
   },
   extraReducers: (builder) => {
     builder
@@ -171,6 +216,7 @@ export const {
   applyTheme,
   applyLanguageChange,
   setClaudeActive, // Export new action
+  updatePreferencesFromWs,
 } = preferencesSlice.actions;
 
 export default preferencesSlice.reducer;
@@ -0,0 +1,88 @@
+import {
+  applyThemeClass,
+  applyLanguage,
+  updatePreferencesFromWs,
+} from "./preferencesSlice";
+import { receiveNotifications } from "./notificationsSlice";
+
+const WS_BASE_URL = "ws://localhost:8000";
+
+// WebSocket connection for real-time updates
+let socket = null;
+let reconnectTimer = null;
+// Delay requested by the server before it shut down, if any
+let serverRetryDelay = null;
+let reconnectAttempts = 0;
+
+// Reconnect delay: the server's value when it sent one, otherwise
+// exponential backoff with jitter so clients do not reconnect in lockstep
+const nextReconnectDelay = () => {
+  if (serverRetryDelay !== null) {
+    const delay = serverRetryDelay;
+    serverRetryDelay = null;
+    return delay;
+  }
+  const base = Math.min(30000, 1000 * 2 ** reconnectAttempts);
+  reconnectAttempts += 1;
+  return base / 2 + Math.random() * (base / 2);
+};
+
+export const connectPreferencesSocket = (userId, dispatch) => {
+  disconnectPreferencesSocket();
+
+  const clientId = `user_${userId}_${Date.now()}`;
+  // With the access token the server sends unacknowledged notifications on connect
+  const token = localStorage.getItem("token");
+  const query = token ? `?token=${encodeURIComponent(token)}` : "";
+  socket = new WebSocket(`${WS_BASE_URL}/ws/preferences/${clientId}${query}`);
+
+  socket.onopen = () => {
+    reconnectAttempts = 0;
+  };
+
+  socket.onmessage = (event) => {
+    try {
+      const data = JSON.parse(event.data);
+      if (data.type === "reconnect") {
+        serverRetryDelay = data.retry_after_ms;
+        return;
+      }
+      if (data.type === "preferences_updated") {
+        applyThemeClass(data.data.theme);
+        applyLanguage(data.data.language);
+        dispatch(updatePreferencesFromWs(data.data));
+      } else if (data.type === "notification") {
+        dispatch(receiveNotifications([data.data]));
+      } else if (data.type === "notifications_backfill") {
+        dispatch(receiveNotifications(data.data));
+      }
+    } catch (error) {
+      console.error("Failed to parse WebSocket message:", error);
+    }
+  };
+
+  socket.onclose = () => {
+    const delay = nextReconnectDelay();
+    console.log(`WebSocket disconnected. Reconnecting in ${Math.round(delay)}ms...`);
+    reconnectTimer = setTimeout(() => {
+      connectPreferencesSocket(userId, dispatch);
+    }, delay);
+  };
+
+  socket.onerror = (error) => {
+    console.error("WebSocket error:", error);
+  };
+};
+
+export const disconnectPreferencesSocket = () => {
+  if (reconnectTimer) {
+    clearTimeout(reconnectTimer);
+    reconnectTimer = null;
+  }
+  if (socket) {
+    // Closed on purpose, so do not schedule a reconnect
+    socket.onclose = null;
+    socket.close();
+    socket = null;
+  }
+};